@@ -0,0 +1,222 @@
+import os
+import json
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, Optional, Set, Tuple
+
+from .schemas import TrainingEmail
+
+# (category, language, tone, difficulty, scenario_id)
+Bucket = Tuple[str, str, str, int, str]
+
+
+def bucket_key(bucket: Bucket) -> str:
+    return ":".join(str(part) for part in bucket)
+
+
+def parse_bucket(key: str) -> Bucket:
+    # scenario_id goes last so it may contain ":" itself
+    category, language, tone, difficulty, scenario_id = key.split(":", 4)
+    return (category, language, tone, int(difficulty), scenario_id)
+
+
+class EmailPool:
+    """
+    Keeps `target` validated TrainingEmails ready per bucket so quiz requests
+    don't wait on Ollama. A background worker tops buckets back up after they
+    are drawn from. With a `path`, the pool is saved to a JSON file after each
+    refill sweep so a restart doesn't start cold. Buckets are registered by the
+    first request that needs them (or up front via `preload`).
+
+    Scenario ids come from callers, so request-registered buckets are capped at
+    `max_buckets` (least recently used idle bucket evicted first) and dropped
+    after `max_fill_failures` failed fills in a row. Preloaded buckets are
+    pinned: never evicted, and retried every `retry_s` while Ollama is down.
+    """
+
+    def __init__(self, fill_fn: Callable[[Bucket], Awaitable[Optional[TrainingEmail]]],
+                 path: Optional[str], target: int = 5, retry_s: float = 30.0,
+                 max_buckets: int = 32, max_fill_failures: int = 3):
+        self.fill_fn = fill_fn
+        self.path = path
+        self.target = max(1, int(target))
+        self.retry_s = max(0.0, float(retry_s))
+        self.max_buckets = max(1, int(max_buckets))
+        self.max_fill_failures = max(1, int(max_fill_failures))
+
+        # Least recently used first
+        self._buckets: "OrderedDict[Bucket, Deque[dict]]" = OrderedDict()
+        self._pinned: Set[Bucket] = set()
+        self._failures: Dict[Bucket, int] = {}
+        self._filling: Optional[Bucket] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._stats = dict.fromkeys(("hits", "misses", "generated", "fill_failures", "evictions", "abandoned"), 0)
+
+    # ----------------------------
+    # Lifecycle (called from the FastAPI lifespan)
+    # ----------------------------
+
+    def start(self, preload: Iterable[Bucket] = ()) -> None:
+        for bucket in preload:
+            self._pinned.add(bucket)
+            self._buckets.setdefault(bucket, deque())
+        self._load()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._worker = asyncio.create_task(self._refill_forever())
+        print(f"✅ Email pool started ({len(self._buckets)} buckets, {self.ready()} emails ready)")
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self._save()
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+
+    def take(self, bucket: Bucket) -> Optional[TrainingEmail]:
+        """A ready email for the bucket, or None (the bucket is then queued for refill)."""
+        queue = self._buckets.get(bucket)
+        if queue is None:
+            queue = self._register(bucket)
+            if queue is None:
+                self._stats["misses"] += 1
+                return None
+        else:
+            self._buckets.move_to_end(bucket)
+        email = None
+        while queue and email is None:
+            try:
+                email = TrainingEmail(**queue.popleft())
+            except Exception:
+                continue  # stored by an older schema
+        self._stats["hits" if email is not None else "misses"] += 1
+        self._dirty = self._dirty or email is not None
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return email
+
+    def ready(self) -> int:
+        return sum(len(queue) for queue in self._buckets.values())
+
+    def metrics(self) -> Dict:
+        return {
+            **self._stats,
+            "target_per_bucket": self.target,
+            "max_buckets": self.max_buckets,
+            "ready": self.ready(),
+            "buckets": {bucket_key(b): len(q) for b, q in self._buckets.items()},
+            "running": self._worker is not None and not self._worker.done(),
+        }
+
+    # ----------------------------
+    # Buckets
+    # ----------------------------
+
+    def _register(self, bucket: Bucket) -> Optional[Deque[dict]]:
+        """Adds a request-registered bucket, evicting the least recently used idle one at the cap."""
+        unpinned = [b for b in self._buckets if b not in self._pinned]
+        if len(unpinned) >= self.max_buckets:
+            victim = next((b for b in unpinned if b != self._filling), None)
+            if victim is None:
+                return None
+            self._drop(victim)
+            self._stats["evictions"] += 1
+        queue = self._buckets[bucket] = deque()
+        return queue
+
+    def _drop(self, bucket: Bucket) -> None:
+        del self._buckets[bucket]
+        self._failures.pop(bucket, None)
+        self._dirty = True
+
+    def _record_failure(self, bucket: Bucket) -> bool:
+        """Counts a failed fill; returns True if the bucket should be retried later."""
+        self._stats["fill_failures"] += 1
+        failures = self._failures[bucket] = self._failures.get(bucket, 0) + 1
+        if bucket in self._pinned or failures < self.max_fill_failures:
+            return True
+        print(f"[⚠️ EMAIL POOL] Giving up on {bucket_key(bucket)} after {failures} failed fills")
+        self._drop(bucket)
+        self._stats["abandoned"] += 1
+        return False
+
+    # ----------------------------
+    # Refill worker
+    # ----------------------------
+
+    async def _refill_forever(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            failed = False
+            for bucket, queue in list(self._buckets.items()):
+                # Evicted while an earlier bucket was being filled
+                while self._buckets.get(bucket) is queue and len(queue) < self.target:
+                    self._filling = bucket
+                    try:
+                        email = await self.fill_fn(bucket)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        print(f"[⚠️ EMAIL POOL] Refill failed for {bucket_key(bucket)}: {e}")
+                        email = None
+                    finally:
+                        self._filling = None
+                    if email is None:
+                        failed = self._record_failure(bucket) or failed
+                        break
+                    self._failures.pop(bucket, None)
+                    queue.append(email.model_dump())
+                    self._stats["generated"] += 1
+                    self._dirty = True
+            await self._save()
+            if failed:
+                # Ollama is down or the model keeps failing validation: try again later
+                await asyncio.sleep(self.retry_s)
+                self._wakeup.set()
+
+    # ----------------------------
+    # On-disk store
+    # ----------------------------
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[⚠️ EMAIL POOL] Could not load {self.path}: {e}")
+            return
+        for key, emails in stored.items():
+            try:
+                bucket = parse_bucket(key)
+            except ValueError:
+                print(f"[⚠️ EMAIL POOL] Skipping stored bucket with an old key format: {key}")
+                continue
+            if bucket in self._pinned or self._register(bucket) is not None:
+                self._buckets[bucket] = deque(emails[: self.target])
+
+    async def _save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        # Snapshot on the event loop, write in a thread so requests aren't blocked on disk
+        snapshot = {bucket_key(b): list(q) for b, q in self._buckets.items()}
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+        except OSError as e:
+            self._dirty = True
+            print(f"[⚠️ EMAIL POOL] Could not save {self.path}: {e}")
+
+    def _write(self, snapshot: Dict[str, list]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)  # atomic, so a crash never leaves a half-written pool
@@ -1,8 +1,14 @@
 import json
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+from pydantic import TypeAdapter, ValidationError
 from .schemas import TrainingEmail
 
+try:
+    import orjson  # optional, ~3-5x faster parsing of model output
+except ImportError:
+    orjson = None
+
 # Only allow training links (safety + consistency)
 _ALLOWED_URL = re.compile(
     r"^https://([a-zA-Z0-9\-\._]+\.)?tedd\.training(/[^\s\"]*)?$"
@@ -10,20 +16,192 @@ _ALLOWED_URL = re.compile(
 
 TRAINING_FOOTER = "(This is a training simulation email.)"
 
+# Structural characters of (possibly unfinished) model output, and the rest of a string after its opening quote
+_JSON_TOKEN = re.compile(r'[{}\[\]:,"]')
+_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+# Built once; validate_python skips the per-call model construction overhead of TrainingEmail(**obj)
+_EMAIL_ADAPTER = TypeAdapter(TrainingEmail)
+
+_VERSION_FIELDS = ("email_id", "model_version", "prompt_version")
+
+
+# ----------------------------
+# Errors
+# ----------------------------
+
+# Error codes, so callers can retry with a prompt aimed at the actual problem
+INVALID_JSON = "invalid_json"
+NOT_AN_OBJECT = "not_an_object"
+INVALID_LINKS = "invalid_links"
+DISALLOWED_URL = "disallowed_url"
+SCHEMA = "schema"
+
+
+class GuardrailError(ValueError):
+    """Model output rejected by the guardrails. `code` is one of the error codes above."""
+
+    def __init__(self, code: str, message: str, fields: Optional[List[str]] = None):
+        super().__init__(message)
+        self.code = code
+        self.fields = fields or []
+
+
+class GuardrailViolation(GuardrailError):
+    """Model output that can never pass validation, detected before generation finished."""
 
-def _extract_json_block(text: str) -> Dict[str, Any]:
+
+# What a value inside the top-level object is, as far as the links guardrail cares
+_LINKS = "links"     # the top-level "links" value
+_LINK_ITEM = "item"  # an element of the "links" array
+_LINK_URL = "url"    # the "url" of a links object
+
+
+class _Frame:
+    __slots__ = ("is_object", "role", "key", "expecting_key")
+
+    def __init__(self, is_object: bool, role: Optional[str]):
+        self.is_object = is_object
+        self.role = role
+        self.key = None
+        self.expecting_key = is_object
+
+
+class PartialOutputChecker:
+    """
+    Applies the guardrails that can be decided on incomplete output (currently
+    the URL allowlist) while the model is still generating. Feed it the whole
+    text so far after every chunk; it resumes where it stopped and raises
+    GuardrailViolation as soon as a finished URL would fail final validation.
+
+    Only the URLs _clean_links checks are looked at: a "links" string, the
+    "url" of a "links" object, and the "url" of each object in a "links"
+    array. A "url" anywhere else (e.g. inside headers) is left alone.
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.stack: List[_Frame] = []
+        self.done = False
+
+    def feed(self, text: str) -> None:
+        while not self.done:
+            if not self.stack:
+                # Like the stream's JSON tracker, everything before the first "{" is preamble
+                start = text.find("{", self.pos)
+                if start == -1:
+                    self.pos = len(text)
+                    return
+                self.stack.append(_Frame(True, None))
+                self.pos = start + 1
+                continue
+
+            match = _JSON_TOKEN.search(text, self.pos)
+            if match is None:
+                self.pos = len(text)
+                return
+            i, ch = match.start(), match.group()
+            if ch == '"':
+                tail = _STRING_TAIL.match(text, i + 1)
+                if tail is None:
+                    self.pos = i  # unfinished string, re-read it once more text arrives
+                    return
+                self.pos = tail.end()
+                self._string(text[i : tail.end()])
+                continue
+
+            self.pos = i + 1
+            top = self.stack[-1]
+            if ch in "{[":
+                kind = self._value_kind(top)
+                if ch == "{":
+                    self.stack.append(_Frame(True, _LINK_ITEM if kind in (_LINKS, _LINK_ITEM) else None))
+                else:
+                    self.stack.append(_Frame(False, _LINKS if kind == _LINKS else None))
+            elif ch in "}]":
+                self.stack.pop()
+                self.done = not self.stack
+            elif ch == ":":
+                top.expecting_key = False
+            elif top.is_object:  # ","
+                top.expecting_key = True
+
+    def _value_kind(self, frame: _Frame) -> Optional[str]:
+        if len(self.stack) == 1 and frame.key == "links":
+            return _LINKS
+        if frame.role == _LINKS and not frame.is_object:
+            return _LINK_ITEM
+        if frame.role == _LINK_ITEM and frame.key == "url":
+            return _LINK_URL
+        return None
+
+    def _string(self, raw: str) -> None:
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw[1:-1]
+        top = self.stack[-1]
+        if top.is_object and top.expecting_key:
+            top.key = value
+            return
+        if self._value_kind(top) in (_LINKS, _LINK_URL):
+            url = value.strip()
+            if url and not _ALLOWED_URL.match(url):
+                raise GuardrailViolation(DISALLOWED_URL, f"Disallowed URL: {url}", ["links"])
+
+
+def _has_coerced_float(obj: Any) -> bool:
+    """
+    True if a value whose str()/int() ends up in the email is a float. orjson
+    parses ints beyond 64 bits as floats; everywhere else a float fails the
+    schema either way, so only top-level values and link fields are checked.
+    """
+    if type(obj) is not dict:
+        return False
+    for value in obj.values():
+        if type(value) is float:
+            return True
+    links = obj.get("links")
+    for link in (links if type(links) is list else [links]):
+        if type(link) is dict:
+            for value in link.values():
+                if type(value) is float:
+                    return True
+    return False
+
+
+def _loads(text: str) -> Any:
+    if orjson is not None:
+        try:
+            obj = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            # Only a few inputs are valid for the stdlib but not orjson (NaN, Infinity, 1e400,
+            # lone surrogates); anything else is just malformed, so don't parse it twice
+            reason = str(e)
+            if not ("NaN" in text or "Infinity" in text or "infinity" in reason or "surrogate" in reason):
+                raise
+        else:
+            if not _has_coerced_float(obj):
+                return obj
+    return json.loads(text)
+
+
+def _extract_json_block(text: str) -> Any:
     """
     Extracts the first valid JSON object from model output.
     Handles cases where the model adds extra text.
     """
     try:
-        return json.loads(text)
+        return _loads(text)
     except Exception:
         start = text.find("{")
         end = text.rfind("}")
         if start == -1 or end == -1 or end <= start:
-            raise ValueError("Model did not return valid JSON.")
-        return json.loads(text[start : end + 1])
+            raise GuardrailError(INVALID_JSON, "Model did not return valid JSON.")
+        try:
+            return _loads(text[start : end + 1])
+        except ValueError as e:
+            raise GuardrailError(INVALID_JSON, f"Model did not return valid JSON: {e}") from e
 
 
 def _enforce_training_footer(body_text: str) -> str:
@@ -33,19 +211,17 @@ def _enforce_training_footer(body_text: str) -> str:
     return body_text
 
 
-def _normalize_links(obj: Dict[str, Any]) -> None:
+def _clean_links(links: Any) -> List[Dict[str, str]]:
     """
-    Make sure obj["links"] becomes a list[dict] with {display_text, url}.
-    Common LLM mistakes:
+    Turns whatever the model put in "links" into list[{display_text, url}] and
+    applies the URL allowlist in the same loop. Common LLM mistakes:
       - links is a dict
       - links is a string
       - links missing
       - items missing keys
     """
-    links = obj.get("links", [])
     if links is None:
-        obj["links"] = []
-        return
+        return []
 
     # If model returns single dict, wrap it.
     if isinstance(links, dict):
@@ -56,88 +232,78 @@ def _normalize_links(obj: Dict[str, Any]) -> None:
         links = [{"display_text": "Open Link", "url": links.strip()}]
 
     if not isinstance(links, list):
-        raise ValueError("links must be a list")
+        raise GuardrailError(INVALID_LINKS, "links must be a list", ["links"])
 
     cleaned: List[Dict[str, str]] = []
     for item in links:
         if not isinstance(item, dict):
             continue
-        display_text = str(item.get("display_text") or item.get("text") or "Open Link")
         url = str(item.get("url") or "").strip()
 
         # Keep empty URLs out
         if not url:
             continue
 
-        cleaned.append({"display_text": display_text, "url": url})
-
-    obj["links"] = cleaned
+        if not _ALLOWED_URL.match(url):
+            raise GuardrailError(DISALLOWED_URL, f"Disallowed URL: {url}", ["links"])
 
+        display_text = str(item.get("display_text") or item.get("text") or "Open Link")
+        cleaned.append({"display_text": display_text, "url": url})
 
-def _enforce_url_allowlist(obj: Dict[str, Any]) -> None:
-    for link in obj.get("links", []):
-        url = (link.get("url") or "").strip()
-        if url and not _ALLOWED_URL.match(url):
-            raise ValueError(f"Disallowed URL: {url}")
+    return cleaned
 
 
-def _normalize_types(obj: Dict[str, Any]) -> None:
-    # email_id must be string if present
-    if "email_id" in obj and obj["email_id"] is not None and not isinstance(obj["email_id"], str):
-        obj["email_id"] = str(obj["email_id"])
+def validate_and_parse_email(raw_text: str) -> TrainingEmail:
+    """
+    Single pass over the model output:
+    1) Extract JSON safely (orjson when installed)
+    2) Normalize common LLM mistakes, field by field
+    3) Enforce URL allowlist while cleaning links
+    4) Enforce training footer + required fields
+    5) Force ground_truth = category
+    6) Validate schema with the prebuilt TypeAdapter
 
-    # model_version / prompt_version must be strings if present
-    if "model_version" in obj and obj["model_version"] is not None and not isinstance(obj["model_version"], str):
-        obj["model_version"] = str(obj["model_version"])
+    Raises GuardrailError with a `code` saying which step failed.
+    """
+    obj = _extract_json_block(raw_text)
+    if not isinstance(obj, dict):
+        raise GuardrailError(NOT_AN_OBJECT, f"Model returned a JSON {type(obj).__name__}, not an object.")
 
-    if "prompt_version" in obj and obj["prompt_version"] is not None and not isinstance(obj["prompt_version"], str):
-        obj["prompt_version"] = str(obj["prompt_version"])
+    # email_id / model_version / prompt_version must be strings if present
+    for field in _VERSION_FIELDS:
+        value = obj.get(field)
+        if value is not None and not isinstance(value, str):
+            obj[field] = str(value)
 
     # difficulty if returned as string -> int
-    if "difficulty" in obj and isinstance(obj["difficulty"], str) and obj["difficulty"].isdigit():
-        obj["difficulty"] = int(obj["difficulty"])
+    difficulty = obj.get("difficulty")
+    if isinstance(difficulty, str) and difficulty.isdigit():
+        obj["difficulty"] = int(difficulty)
 
     # Ensure headers exists as dict
-    headers = obj.get("headers")
-    if headers is None:
-        obj["headers"] = {}
-    elif not isinstance(headers, dict):
+    if not isinstance(obj.get("headers"), dict):
         obj["headers"] = {}
 
+    obj["links"] = _clean_links(obj.get("links", []))
 
-def _enforce_required_fields(obj: Dict[str, Any]) -> None:
     # Never allow empty subject
     if not obj.get("subject"):
         obj["subject"] = "Important Account Notification"
 
     # Enforce footer in body
-    if "body_text" in obj and isinstance(obj["body_text"], str):
-        obj["body_text"] = _enforce_training_footer(obj["body_text"])
-    else:
-        obj["body_text"] = _enforce_training_footer(str(obj.get("body_text") or ""))
+    body_text = obj.get("body_text")
+    obj["body_text"] = _enforce_training_footer(body_text if isinstance(body_text, str) else str(body_text or ""))
 
     # Benign emails should not have red flags
-    if obj.get("category") == "benign":
+    category = obj.get("category")
+    if category == "benign":
         obj["intended_red_flags"] = None
 
-
-def validate_and_parse_email(raw_text: str) -> TrainingEmail:
-    """
-    1) Extract JSON safely
-    2) Normalize common LLM mistakes
-    3) Enforce URL allowlist
-    4) Enforce training footer + required fields
-    5) Force ground_truth = category
-    6) Validate schema
-    """
-    obj = _extract_json_block(raw_text)
-
-    _normalize_types(obj)
-    _normalize_links(obj)
-    _enforce_url_allowlist(obj)
-    _enforce_required_fields(obj)
-
     # ✅ Always force ground_truth to match category (no exceptions)
-    obj["ground_truth"] = obj.get("category")
+    obj["ground_truth"] = category
 
-    return TrainingEmail(**obj)
\ No newline at end of file
+    try:
+        return _EMAIL_ADAPTER.validate_python(obj)
+    except ValidationError as e:
+        fields = sorted({str(err["loc"][0]) for err in e.errors(include_url=False) if err["loc"]})
+        raise GuardrailError(SCHEMA, f"Schema validation failed for: {', '.join(fields)}", fields) from e
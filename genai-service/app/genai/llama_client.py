@@ -1,46 +1,243 @@
 import httpx
 import os
 import re
+import json
+import time
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
+from .guardrails import PartialOutputChecker, GuardrailViolation
+
 load_dotenv("../.env")
 
 OLLAMA_URL = os.environ.get("OLLAMA_URL")
 MODEL_NAME = os.environ.get("OLLAMA_MODEL")
 
+# Connection pool settings (one client for the whole app, opened in the lifespan)
+OLLAMA_TIMEOUT_S = float(os.environ.get("OLLAMA_TIMEOUT_S", "300"))  # 5 minutes, first-time model warmup is slow
+OLLAMA_CONNECT_TIMEOUT_S = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT_S", "10"))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "10"))
+OLLAMA_MAX_KEEPALIVE = int(os.environ.get("OLLAMA_MAX_KEEPALIVE", str(OLLAMA_MAX_CONNECTIONS)))
+OLLAMA_KEEPALIVE_EXPIRY_S = float(os.environ.get("OLLAMA_KEEPALIVE_EXPIRY_S", "60"))
+# Read the token stream and stop as soon as the JSON object closes (or breaks a guardrail)
+OLLAMA_STREAM = os.environ.get("OLLAMA_STREAM", "1") == "1"
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+# ----------------------------
+# Client lifecycle
+# ----------------------------
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(OLLAMA_TIMEOUT_S, connect=OLLAMA_CONNECT_TIMEOUT_S),
+        limits=httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_S,
+        ),
+    )
+
+
+async def open_client() -> None:
+    """Creates the shared keep-alive client. Called once from the FastAPI lifespan."""
+    global _client
+    if _client is None:
+        _client = _new_client()
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    # Lazily opened so call_ollama still works outside the app (scripts, REPL)
+    global _client
+    if _client is None:
+        _client = _new_client()
+    return _client
+
+
+# ----------------------------
+# Call metrics
+# ----------------------------
+
+class _CallMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+        self.stopped_at_close = 0
+        self.guardrail_aborts = 0
+
+    def record(self, elapsed_ms: float, ok: bool) -> None:
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.last_ms = elapsed_ms
+
+    def snapshot(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "last_ms": round(self.last_ms, 1),
+            "stopped_at_close": self.stopped_at_close,
+            "guardrail_aborts": self.guardrail_aborts,
+        }
+
+
+_metrics = _CallMetrics()
+
+
+def ollama_metrics() -> Dict:
+    return {
+        **_metrics.snapshot(),
+        "url": OLLAMA_URL,
+        "model": MODEL_NAME,
+        "max_connections": OLLAMA_MAX_CONNECTIONS,
+        "max_keepalive": OLLAMA_MAX_KEEPALIVE,
+        "stream": OLLAMA_STREAM,
+    }
 
-async def call_ollama(prompt: str) -> str:
-    """
-    Calls local Ollama LLaMA model and returns raw text output.
-    Increased timeout to handle first-time model warmup.
-    """
 
-    timeout = httpx.Timeout(300.0)  # 5 minutes
-
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(
-            OLLAMA_URL,
-            json={
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "format": "json",  # Forces strict JSON mode in Ollama
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": 1500
-                }
-            }
-        )
+# ----------------------------
+# Generation
+# ----------------------------
 
+def _request_body(prompt: str, stream: bool) -> Dict:
+    return {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "format": "json",  # Forces strict JSON mode in Ollama
+        "stream": stream,
+        "options": {
+            "temperature": 0.3,
+            "num_predict": 1500
+        }
+    }
+
+
+def _extract_json_payload(raw_text: str) -> str:
+    # Aggressively extract ONLY the JSON payload, cutting out any leftover markdown garbage
+    match = re.search(r'\{.*\}', raw_text, re.DOTALL)
+    if match:
+        raw_text = match.group(0)
+    return raw_text.strip()
+
+
+class _JsonObjectTracker:
+    """Incrementally finds where the first top-level JSON object in a token stream closes."""
+
+    def __init__(self):
+        self.start = -1
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.pos = 0
+
+    def feed(self, text: str) -> int:
+        """Scans text from where the last call stopped; returns the index of the closing brace or -1."""
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.start != -1:
+                    self.in_string = True
+            elif ch == "{":
+                if self.start == -1:
+                    self.start = i
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.pos = i + 1
+                    return i
+        self.pos = len(text)
+        return -1
+
+
+async def _call_ollama_buffered(client: httpx.AsyncClient, prompt: str) -> str:
+    response = await client.post(OLLAMA_URL, json=_request_body(prompt, stream=False))
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Ollama error {response.status_code}: {response.text}")
+
+    data = response.json()
+    return _extract_json_payload(data.get("response", ""))
+
+
+async def _call_ollama_streaming(client: httpx.AsyncClient, prompt: str) -> str:
+    # Leaving the `async with` early closes the connection, which makes Ollama stop generating
+    tracker = _JsonObjectTracker()
+    checker = PartialOutputChecker()
+    text = ""
+    async with client.stream("POST", OLLAMA_URL, json=_request_body(prompt, stream=True)) as response:
         if response.status_code != 200:
-            raise RuntimeError(f"Ollama error {response.status_code}: {response.text}")
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            raise RuntimeError(f"Ollama error {response.status_code}: {body}")
+
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(f"Ollama error: {chunk['error']}")
+            text += chunk.get("response", "")
+
+            try:
+                checker.feed(text)
+            except GuardrailViolation:
+                _metrics.guardrail_aborts += 1
+                raise
+
+            end = tracker.feed(text)
+            if end != -1:
+                if not chunk.get("done"):
+                    _metrics.stopped_at_close += 1
+                return text[tracker.start : end + 1]
+            if chunk.get("done"):
+                break
+
+    return _extract_json_payload(text)
+
+
+async def call_ollama(prompt: str, stream: Optional[bool] = None) -> str:
+    """
+    Calls local Ollama LLaMA model and returns raw text output.
+    Reuses the app-wide pooled client; point OLLAMA_URL at a mock server for tests.
+
+    In streaming mode (OLLAMA_STREAM, the default) generation is cut off as soon
+    as the top-level JSON object closes, and output that already breaks a
+    guardrail raises GuardrailViolation without waiting for the rest.
+    """
 
-        data = response.json()
-        raw_text = data.get("response", "")
-        
-        # Aggressively extract ONLY the JSON payload, cutting out any leftover markdown garbage
-        match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-        if match:
-            raw_text = match.group(0)
+    client = _get_client()
+    use_stream = OLLAMA_STREAM if stream is None else stream
+    started = time.perf_counter()
+    ok = False
+    try:
+        if use_stream:
+            raw_text = await _call_ollama_streaming(client, prompt)
+        else:
+            raw_text = await _call_ollama_buffered(client, prompt)
+        ok = True
+    finally:
+        _metrics.record((time.perf_counter() - started) * 1000, ok)
 
-        return raw_text.strip()
\ No newline at end of file
+    return raw_text.strip()
@@ -3,28 +3,59 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from email.utils import format_datetime
 from uuid import uuid4
-from typing import Dict, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Tuple
 from dotenv import load_dotenv
 import re
+import json
+import time
 import random
 import os
+import asyncio
 
 load_dotenv("../.env")
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
 from .schemas import (
     QuizPlan,
     TrainingEmail,
     InboxQuizRequest,
+    GmailMessageMeta,
 )
 from .prompts import build_email_prompt, PROMPT_VERSION
 from .llama_client import call_ollama
-from .guardrails import validate_and_parse_email
+from .guardrails import (
+    validate_and_parse_email,
+    GuardrailViolation,
+    INVALID_LINKS,
+    DISALLOWED_URL,
+    SCHEMA,
+)
+from .email_pool import EmailPool, Bucket, parse_bucket
 
 MODEL_VERSION = os.environ.get("OLLAMA_MODEL")
+# How many quiz emails are generated at once (keep <= OLLAMA_NUM_PARALLEL on the Ollama side)
+GENAI_MAX_CONCURRENCY = max(1, int(os.environ.get("GENAI_MAX_CONCURRENCY", "4")))
+# Inbox context per user, reused by repeat quizzes over the same messages
+INBOX_CONTEXT_CACHE_TTL_S = float(os.environ.get("INBOX_CONTEXT_CACHE_TTL_S", "900"))
+INBOX_CONTEXT_CACHE_MAX_ENTRIES = max(1, int(os.environ.get("INBOX_CONTEXT_CACHE_MAX_ENTRIES", "1000")))
+# Pre-generated /quiz-batch emails per (category, language, tone, difficulty, scenario_id) bucket (opt-in)
+EMAIL_POOL_ENABLED = os.environ.get("EMAIL_POOL_ENABLED", "0") == "1"
+EMAIL_POOL_TARGET = int(os.environ.get("EMAIL_POOL_TARGET", "5"))
+EMAIL_POOL_PATH = os.environ.get("EMAIL_POOL_PATH", "")  # e.g. /data/email_pool.json; "" = memory only
+EMAIL_POOL_RETRY_S = float(os.environ.get("EMAIL_POOL_RETRY_S", "30"))
+# Request-registered buckets kept at once (LRU), and failed fills in a row before one is dropped
+EMAIL_POOL_MAX_BUCKETS = int(os.environ.get("EMAIL_POOL_MAX_BUCKETS", "32"))
+EMAIL_POOL_MAX_FILL_FAILURES = int(os.environ.get("EMAIL_POOL_MAX_FILL_FAILURES", "3"))
+# Comma-separated buckets to warm at startup, e.g. "phishing:EN:formal:3:Payroll Update,benign:EN:formal:2:Team Lunch"
+EMAIL_POOL_PRELOAD = [parse_bucket(b.strip()) for b in os.environ.get("EMAIL_POOL_PRELOAD", "").split(",") if b.strip()]
 router = APIRouter()
 
+_generation_slots = asyncio.Semaphore(GENAI_MAX_CONCURRENCY)
+
 # ----------------------------
 # Helpers
 # ----------------------------
@@ -55,6 +86,22 @@ def _generate_headers(from_email: str, reply_to: str | None = None) -> Dict[str,
         "X-TEDD-Training": "true",
     }
 
+async def _generate(prompt: str) -> str:
+    # Shared across requests, so concurrent quizzes can't flood Ollama either
+    async with _generation_slots:
+        return await call_ollama(prompt)
+
+async def _gather_in_order(coros) -> list:
+    """Runs coros concurrently, returns results in input order, and cancels the rest on the first failure."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 # ----------------------------
 # Inbox profile
 # ----------------------------
@@ -82,12 +129,50 @@ def _common_sender_domains(from_emails: List[str]) -> List[str]:
         domains[d] = domains.get(d, 0) + 1
     return [d for d, _ in sorted(domains.items(), key=lambda x: x[1], reverse=True)[:5]]
 
-def _build_inbox_prompt(messages: List[dict], category: str, difficulty: int, language: str, tone: str, sub_type: str = "none") -> str:
-    subjects = [m.get("subject", "") for m in messages if isinstance(m, dict)]
-    froms = [m.get("from_email", "") for m in messages if isinstance(m, dict)]
-
-    topics = _topic_keywords_from_subjects(subjects)
-    domains = _common_sender_domains(froms)
+class InboxContext(NamedTuple):
+    """What the inbox prompt needs from a mailbox, computed once per request."""
+    topics: Tuple[str, ...]
+    domains: Tuple[str, ...]
+
+def build_inbox_context(messages: List[GmailMessageMeta]) -> InboxContext:
+    subjects = [m.subject for m in messages]
+    froms = [m.from_email for m in messages]
+    return InboxContext(
+        topics=tuple(_topic_keywords_from_subjects(subjects)),
+        domains=tuple(_common_sender_domains(froms)),
+    )
+
+# user_id -> (messages fingerprint, context, expires_at)
+_inbox_context_cache: "OrderedDict[str, Tuple[int, InboxContext, float]]" = OrderedDict()
+
+def get_inbox_context(user_id: str, messages: List[GmailMessageMeta]) -> InboxContext:
+    """
+    Cached build_inbox_context. Entries are keyed by user_id and only reused
+    while the submitted headers are unchanged (hashing them is far cheaper than
+    re-tokenizing every subject) and the TTL has not passed.
+    """
+    fingerprint = hash(tuple((m.subject, m.from_email) for m in messages))
+    now = time.monotonic()
+    cached = _inbox_context_cache.get(user_id)
+    if cached is not None and cached[0] == fingerprint and cached[2] > now:
+        _inbox_context_cache.move_to_end(user_id)
+        return cached[1]
+
+    context = build_inbox_context(messages)
+    _inbox_context_cache[user_id] = (fingerprint, context, now + INBOX_CONTEXT_CACHE_TTL_S)
+    _inbox_context_cache.move_to_end(user_id)
+    while len(_inbox_context_cache) > INBOX_CONTEXT_CACHE_MAX_ENTRIES:
+        _inbox_context_cache.popitem(last=False)
+    return context
+
+def _build_inbox_prompt(context: InboxContext, category: str, difficulty: int, language: str, tone: str, sub_type: str = "none") -> str:
+    # A quiz only has a handful of distinct (category, sub_type) combinations, so most items hit the cache
+    return _render_inbox_prompt(context.topics, context.domains, category, difficulty, language, tone, sub_type)
+
+@lru_cache(maxsize=256)
+def _render_inbox_prompt(topics: Tuple[str, ...], domains: Tuple[str, ...], category: str, difficulty: int, language: str, tone: str, sub_type: str) -> str:
+    topics = list(topics)
+    domains = list(domains)
 
     if category == "benign":
         goal_instruction = "Write a realistic, completely safe, boring office email. NO urgency, NO threats."
@@ -157,81 +242,221 @@ JSON ONLY.
 """.strip()
 
 # ----------------------------
-# Endpoints
+# Pre-generation pool
 # ----------------------------
 
-@router.post("/quiz-batch", response_model=list[TrainingEmail])
-async def generate_quiz_batch(plan: QuizPlan):
-    results: list[TrainingEmail] = []
-    for item in plan.items:
-        prompt = build_email_prompt(
-            scenario_id=item.scenario_id, category=item.category,
-            difficulty=item.difficulty, language=item.language, tone=item.tone,
-        )
-        raw = await call_ollama(prompt)
+def _quiz_item_bucket(item) -> Bucket:
+    return (item.category, item.language, item.tone, item.difficulty, item.scenario_id)
+
+async def _fill_pool_bucket(bucket: Bucket) -> TrainingEmail | None:
+    category, language, tone, difficulty, scenario_id = bucket
+    prompt = build_email_prompt({"scenario_id": scenario_id, "category": category, "difficulty": difficulty,
+                                 "language": language, "tone": tone})
+    try:
+        raw = await _generate(prompt)
+        return validate_and_parse_email(raw)
+    except GuardrailViolation as e:
+        print(f"[⚠️ EMAIL POOL] Pre-generated email rejected mid-stream: {e}")
+        return None
+    except (ValueError, TypeError, AttributeError) as e:  # JSON / normalization / pydantic errors
+        print(f"[⚠️ EMAIL POOL] Pre-generated email failed validation: {e}")
+        return None
+
+email_pool = EmailPool(_fill_pool_bucket, EMAIL_POOL_PATH, target=EMAIL_POOL_TARGET, retry_s=EMAIL_POOL_RETRY_S,
+                       max_buckets=EMAIL_POOL_MAX_BUCKETS, max_fill_failures=EMAIL_POOL_MAX_FILL_FAILURES)
+
+def _personalize_pooled_email(email: TrainingEmail, item) -> TrainingEmail:
+    # Pooled emails were written for this scenario but not this quiz; give them fresh ids
+    email.email_id = f"email_{uuid4().hex[:8]}"
+    email.scenario_id = item.scenario_id
+    email.model_version = email.model_version or MODEL_VERSION
+    email.prompt_version = email.prompt_version or PROMPT_VERSION
+    return email
+
+# ----------------------------
+# Item generation
+# ----------------------------
+# Each generator fills `progress` ({"attempts", "source", "error_codes"}) for the streaming endpoints.
+
+_DEFAULT_RETRY_HINT = "Return VALID JSON ONLY. NO MARKDOWN. NO EXTRA TEXT."
+
+def _retry_prompt(prompt: str, error: Exception) -> str:
+    """The original prompt plus a correction aimed at what the guardrails rejected."""
+    code = getattr(error, "code", None)
+    if code == DISALLOWED_URL:
+        hint = "Every 'url' in 'links' MUST start with https://tedd.training/. If this email has no link, 'links' MUST be []."
+    elif code == INVALID_LINKS:
+        hint = "'links' MUST be a JSON array of objects like {\"display_text\": \"...\", \"url\": \"...\"}, or []."
+    elif code == SCHEMA and getattr(error, "fields", None):
+        hint = f"These keys were missing or had the wrong type: {', '.join(error.fields)}. Fill in EVERY key of the JSON template."
+    else:
+        return f"{prompt}\n\n{_DEFAULT_RETRY_HINT}"
+    return f"{prompt}\n\n{hint}\n{_DEFAULT_RETRY_HINT}"
+
+async def _generate_batch_item(item, progress: Dict) -> TrainingEmail | None:
+    if EMAIL_POOL_ENABLED:
+        pooled = email_pool.take(_quiz_item_bucket(item))
+        if pooled is not None:
+            progress["source"] = "pool"
+            return _personalize_pooled_email(pooled, item)
+
+    progress["source"] = "live"
+    progress["attempts"] = 1
+    prompt = build_email_prompt(item.model_dump())
+    try:
+        raw = await _generate(prompt)
+    except GuardrailViolation as e:
+        print(f"Batch generation failed: {e}")
+        progress["error_codes"] = [e.code]
+        return None
+    try:
+        email = validate_and_parse_email(raw)
+        email.email_id = email.email_id or f"email_{uuid4().hex[:8]}"
+        return email
+    except Exception as e:
+        print(f"Batch generation failed: {e}")
+        progress["error_codes"] = [getattr(e, "code", "error")]
+        return None
+
+def _plan_inbox_quiz(req: InboxQuizRequest) -> List[Tuple[str, int, str]]:
+    plan: List[Tuple[str, int, str]] = []
+    
+    for i in range(req.quiz.phishing_count):
+        attack_type = random.choice(["link", "bec"])
+        plan.append(("phishing", 5, attack_type))
+        
+    for i in range(req.quiz.benign_count):
+        plan.append(("benign", 1, "none"))
+
+    return plan
+
+async def _generate_inbox_item(context: InboxContext, idx: int, category: str, diff: int, sub_type: str,
+                               language: str, tone: str, progress: Dict) -> TrainingEmail:
+    prompt = _build_inbox_prompt(
+        context=context,
+        category=category, difficulty=diff, language=language,
+        tone=tone, sub_type=sub_type
+    )
+
+    progress["source"] = "live"
+    progress["error_codes"] = []
+    last_error: Exception | None = None
+
+    for attempt in range(2):
+        progress["attempts"] = attempt + 1
         try:
+            # A GuardrailViolation mid-stream counts as a failed attempt, like failed validation
+            raw = await _generate(prompt if attempt == 0 else _retry_prompt(prompt, last_error))
             email = validate_and_parse_email(raw)
+
+            # 🚀 THE FIX: Deterministic Grading Override
+            if category == "benign":
+                email.intended_red_flags = []
+            elif sub_type == "bec":
+                email.intended_red_flags = ["mismatched_sender", "financial_request", "urgency"]
+            else:
+                email.intended_red_flags = ["suspicious_link", "urgency"]
+
             email.email_id = email.email_id or f"email_{uuid4().hex[:8]}"
-            results.append(email)
+            email.scenario_id = email.scenario_id or f"inbox_{category}_{idx:02d}"
+            email.model_version = email.model_version or MODEL_VERSION
+            email.prompt_version = email.prompt_version or PROMPT_VERSION
+
+            safe_from = email.from_email if getattr(email, 'from_email', None) else "system@tedd.training"
+            email.headers = _generate_headers(safe_from, getattr(email, 'reply_to', safe_from))
+
+            return email
+
+        except Exception as e:
+            print(f"\n[⚠️ GENAI ERROR] Validation failed on attempt {attempt}: {e}\n")
+            last_error = e
+            progress["error_codes"].append(getattr(e, "code", "error"))
+            if attempt == 1:
+                raise HTTPException(status_code=500, detail="Generation failed.")
+
+async def _stream_progress(jobs: List[Callable[[Dict], Awaitable[TrainingEmail | None]]]):
+    """
+    Runs every job concurrently and yields one NDJSON line per item as soon as it
+    is ready (completion order, with its plan index), then a summary line.
+    Failed items are reported inline instead of failing the whole quiz.
+    """
+    started = time.perf_counter()
+
+    async def run(index: int, job) -> Dict:
+        progress = {"attempts": 0, "source": None}
+        item_started = time.perf_counter()
+        try:
+            email, error = await job(progress), None
+        except HTTPException as e:
+            email, error = None, e.detail
         except Exception as e:
-            print(f"Batch generation failed: {e}")
-    return results
+            email, error = None, str(e)
+        line = {
+            "index": index,
+            "elapsed_ms": round((time.perf_counter() - item_started) * 1000, 1),
+            "retries": max(0, progress["attempts"] - 1),
+            "source": progress["source"],
+            "error_codes": progress.get("error_codes", []),
+        }
+        if email is not None:
+            line["email"] = email.model_dump()
+        else:
+            line["error"] = error or "Generation failed."
+        return line
+
+    tasks = [asyncio.ensure_future(run(index, job)) for index, job in enumerate(jobs)]
+    generated = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            generated += "email" in line
+            yield json.dumps(line) + "\n"
+        yield json.dumps({
+            "done": True,
+            "generated": generated,
+            "failed": len(tasks) - generated,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }) + "\n"
+    finally:
+        # Client went away (or the stream finished): don't keep generating for nobody
+        for t in tasks:
+            t.cancel()
+
+# ----------------------------
+# Endpoints
+# ----------------------------
+
+@router.post("/quiz-batch", response_model=list[TrainingEmail])
+async def generate_quiz_batch(plan: QuizPlan):
+    generated = await _gather_in_order(_generate_batch_item(item, {}) for item in plan.items)
+    return [email for email in generated if email is not None]
+
+@router.post("/quiz-batch/stream")
+async def generate_quiz_batch_stream(plan: QuizPlan):
+    jobs = [partial(_generate_batch_item, item) for item in plan.items]
+    return StreamingResponse(_stream_progress(jobs), media_type="application/x-ndjson")
 
 @router.post("/quiz-from-inbox", response_model=list[TrainingEmail])
 async def generate_quiz_from_inbox(req: InboxQuizRequest):
-    results: list[TrainingEmail] = []
-
-    phishing_n = req.quiz.phishing_count
-    benign_n = req.quiz.benign_count
     language = req.quiz.language or "EN"
     tone = req.quiz.tone or "formal"
+    context = get_inbox_context(req.user_id, req.messages)
 
-    plan: List[Tuple[str, int, str]] = []
-    
-    for i in range(phishing_n):
-        attack_type = random.choice(["link", "bec"])
-        plan.append(("phishing", 5, attack_type))
-        
-    for i in range(benign_n):
-        plan.append(("benign", 1, "none"))
+    # All items generate concurrently (bounded by GENAI_MAX_CONCURRENCY); results keep plan order
+    return await _gather_in_order(
+        _generate_inbox_item(context, idx, category, diff, sub_type, language, tone, {})
+        for idx, (category, diff, sub_type) in enumerate(_plan_inbox_quiz(req), start=1)
+    )
+
+@router.post("/quiz-from-inbox/stream")
+async def generate_quiz_from_inbox_stream(req: InboxQuizRequest):
+    """Same quiz as /quiz-from-inbox, streamed as NDJSON so the first question can render right away."""
+    language = req.quiz.language or "EN"
+    tone = req.quiz.tone or "formal"
+    context = get_inbox_context(req.user_id, req.messages)
 
-    for idx, (category, diff, sub_type) in enumerate(plan, start=1):
-        prompt = _build_inbox_prompt(
-            messages=[m.model_dump() for m in req.messages],
-            category=category, difficulty=diff, language=language,
-            tone=tone, sub_type=sub_type
-        )
-
-        raw = await call_ollama(prompt)
-
-        for attempt in range(2):
-            try:
-                email = validate_and_parse_email(raw)
-
-                # 🚀 THE FIX: Deterministic Grading Override
-                if category == "benign":
-                    email.intended_red_flags = []
-                elif sub_type == "bec":
-                    email.intended_red_flags = ["mismatched_sender", "financial_request", "urgency"]
-                else:
-                    email.intended_red_flags = ["suspicious_link", "urgency"]
-
-                email.email_id = email.email_id or f"email_{uuid4().hex[:8]}"
-                email.scenario_id = email.scenario_id or f"inbox_{category}_{idx:02d}"
-                email.model_version = email.model_version or MODEL_VERSION
-                email.prompt_version = email.prompt_version or PROMPT_VERSION
-
-                safe_from = email.from_email if getattr(email, 'from_email', None) else "system@tedd.training"
-                email.headers = _generate_headers(safe_from, getattr(email, 'reply_to', safe_from))
-
-                results.append(email)
-                break
-
-            except Exception as e:
-                print(f"\n[⚠️ GENAI ERROR] Validation failed on attempt {attempt}: {e}\n")
-                if attempt == 0:
-                    raw = await call_ollama(prompt + "\n\nReturn VALID JSON ONLY. NO MARKDOWN. NO EXTRA TEXT.")
-                else:
-                    raise HTTPException(status_code=500, detail="Generation failed.")
-
-    return results
\ No newline at end of file
+    jobs = [
+        partial(_generate_inbox_item, context, idx, category, diff, sub_type, language, tone)
+        for idx, (category, diff, sub_type) in enumerate(_plan_inbox_quiz(req), start=1)
+    ]
+    return StreamingResponse(_stream_progress(jobs), media_type="application/x-ndjson")
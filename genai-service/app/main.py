@@ -1,14 +1,27 @@
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from app.genai.router import router as genai_router
+from app.genai.router import router as genai_router, email_pool, EMAIL_POOL_ENABLED, EMAIL_POOL_PRELOAD
+from app.genai.llama_client import open_client, close_client, ollama_metrics
 
 
 # 🚀 1. Tell Python to go up one folder and read the root .env file
 load_dotenv("../.env")
 
-app = FastAPI(title="TEDD GenAI Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One keep-alive Ollama connection pool for the life of the app
+    await open_client()
+    if EMAIL_POOL_ENABLED:
+        email_pool.start(preload=EMAIL_POOL_PRELOAD)
+    yield
+    if EMAIL_POOL_ENABLED:
+        await email_pool.stop()
+    await close_client()
+
+app = FastAPI(title="TEDD GenAI Service", lifespan=lifespan)
 
 # Only add /gen prefix here (NOT in router.py)
 app.include_router(genai_router, prefix="/gen", tags=["GenAI"])
@@ -17,6 +30,13 @@ app.include_router(genai_router, prefix="/gen", tags=["GenAI"])
 def health_check():
     return {"message": "TEDD GenAI Service is running"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "ollama": ollama_metrics(),
+        "email_pool": email_pool.metrics() if EMAIL_POOL_ENABLED else None,
+    }
+
 # 🚀 2. The custom startup logic that forces Uvicorn to use your .env port
 if __name__ == "__main__":
     # It will look for GEN_AI_PORT in your .env, and fall back to 8001 just in case
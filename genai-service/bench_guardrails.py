@@ -0,0 +1,244 @@
+# bench_guardrails.py
+# Compares the fused validate_and_parse_email against the old multi-pass
+# validator over a corpus of LLM outputs, including malformed ones.
+#
+#   python bench_guardrails.py                  # built-in corpus modelled on recorded Ollama outputs
+#   python bench_guardrails.py outputs.jsonl    # real recordings: one JSON string (or {"response": ...}) per line
+import sys
+import json
+import time
+import random
+from typing import Any, Dict, List
+
+from app.genai import guardrails
+from app.genai.guardrails import validate_and_parse_email, TRAINING_FOOTER, _ALLOWED_URL
+from app.genai.schemas import TrainingEmail
+
+
+# ----------------------------
+# The validator guardrails.py used before
+# ----------------------------
+
+def legacy_extract_json_block(text):
+    try:
+        return json.loads(text)
+    except Exception:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start == -1 or end == -1 or end <= start:
+            raise ValueError("Model did not return valid JSON.")
+        return json.loads(text[start : end + 1])
+
+
+def legacy_enforce_training_footer(body_text):
+    body_text = (body_text or "").strip()
+    if not body_text.endswith(TRAINING_FOOTER):
+        body_text = f"{body_text}\n\n{TRAINING_FOOTER}".strip()
+    return body_text
+
+
+def legacy_normalize_links(obj):
+    links = obj.get("links", [])
+    if links is None:
+        obj["links"] = []
+        return
+    if isinstance(links, dict):
+        links = [links]
+    if isinstance(links, str):
+        links = [{"display_text": "Open Link", "url": links.strip()}]
+    if not isinstance(links, list):
+        raise ValueError("links must be a list")
+    cleaned = []
+    for item in links:
+        if not isinstance(item, dict):
+            continue
+        display_text = str(item.get("display_text") or item.get("text") or "Open Link")
+        url = str(item.get("url") or "").strip()
+        if not url:
+            continue
+        cleaned.append({"display_text": display_text, "url": url})
+    obj["links"] = cleaned
+
+
+def legacy_enforce_url_allowlist(obj):
+    for link in obj.get("links", []):
+        url = (link.get("url") or "").strip()
+        if url and not _ALLOWED_URL.match(url):
+            raise ValueError(f"Disallowed URL: {url}")
+
+
+def legacy_normalize_types(obj):
+    if "email_id" in obj and obj["email_id"] is not None and not isinstance(obj["email_id"], str):
+        obj["email_id"] = str(obj["email_id"])
+    if "model_version" in obj and obj["model_version"] is not None and not isinstance(obj["model_version"], str):
+        obj["model_version"] = str(obj["model_version"])
+    if "prompt_version" in obj and obj["prompt_version"] is not None and not isinstance(obj["prompt_version"], str):
+        obj["prompt_version"] = str(obj["prompt_version"])
+    if "difficulty" in obj and isinstance(obj["difficulty"], str) and obj["difficulty"].isdigit():
+        obj["difficulty"] = int(obj["difficulty"])
+    headers = obj.get("headers")
+    if headers is None:
+        obj["headers"] = {}
+    elif not isinstance(headers, dict):
+        obj["headers"] = {}
+
+
+def legacy_enforce_required_fields(obj):
+    if not obj.get("subject"):
+        obj["subject"] = "Important Account Notification"
+    if "body_text" in obj and isinstance(obj["body_text"], str):
+        obj["body_text"] = legacy_enforce_training_footer(obj["body_text"])
+    else:
+        obj["body_text"] = legacy_enforce_training_footer(str(obj.get("body_text") or ""))
+    if obj.get("category") == "benign":
+        obj["intended_red_flags"] = None
+
+
+def legacy_validate_and_parse_email(raw_text):
+    obj = legacy_extract_json_block(raw_text)
+    legacy_normalize_types(obj)
+    legacy_normalize_links(obj)
+    legacy_enforce_url_allowlist(obj)
+    legacy_enforce_required_fields(obj)
+    obj["ground_truth"] = obj.get("category")
+    return TrainingEmail(**obj)
+
+
+# ----------------------------
+# Corpus
+# ----------------------------
+
+def _email(rng: random.Random, category: str, body_paragraphs: int) -> Dict[str, Any]:
+    phishing = category == "phishing"
+    body = "\n\n".join(
+        "Dear colleague, " + " ".join(rng.choice(["invoice", "payroll", "review", "account", "deadline", "portal",
+                                                  "shared", "document", "update", "meeting", "quarterly"]) for _ in range(60))
+        for _ in range(body_paragraphs)
+    )
+    return {
+        "email_id": "",
+        "scenario_id": f"inbox_{category}_{rng.randint(1, 99):02d}",
+        "category": category,
+        "difficulty": 5 if phishing else 1,
+        "subject": "Action required: confirm your payroll details" if phishing else "Minutes from the budget review",
+        "from_name": "HR Payroll" if phishing else "Sarah Lim",
+        "from_email": "payroll@acme-hr-portal.com" if phishing else "sarah.lim@acme.com",
+        "reply_to": "",
+        "body_text": body + "\n\nRegards,\nHR",
+        "links": [{"display_text": "Confirm details", "url": "https://tedd.training/payroll/confirm"}] if phishing else [],
+        "attachments": [],
+        "intended_red_flags": [],
+        "ground_truth": category,
+        "model_version": "",
+        "prompt_version": "",
+    }
+
+
+def builtin_corpus(seed: int = 7) -> List[tuple]:
+    rng = random.Random(seed)
+    corpus = []
+
+    def add(kind, text):
+        corpus.append((kind, text))
+
+    for i in range(40):
+        category = "phishing" if i % 2 else "benign"
+        paragraphs = rng.choice([1, 2, 4, 8])
+        e = _email(rng, category, paragraphs)
+        add("clean (JSON mode)", json.dumps(e))
+        add("pretty + trailing padding", json.dumps(e, indent=2) + "\n" * 40)
+        add("markdown fenced", "```json\n" + json.dumps(e, indent=2) + "\n```")
+        add("preamble + trailing text", "Here is the training email:\n" + json.dumps(e) + "\nLet me know if you need changes.")
+
+        e2 = dict(e, email_id=1000 + i, difficulty=str(e["difficulty"]), model_version=3, headers="none")
+        if category == "phishing":
+            e2["links"] = rng.choice([e["links"][0], e["links"][0]["url"], [{"text": "Open", "url": " https://tedd.training/x "}, {"url": ""}, "junk"]])
+        add("wrong types / link shapes", json.dumps(e2))
+        add("missing subject, body not str", json.dumps(dict(e, subject="", body_text=None if i % 3 else 12345)))
+
+        # malformed
+        if category == "phishing":
+            add("disallowed URL", json.dumps(dict(e, links=[{"display_text": "Login", "url": "https://secure-billing-update.com/login"}])))
+        full = json.dumps(e)
+        add("truncated", full[: rng.randint(len(full) // 3, len(full) - 5)])
+        add("JSON array", "[" + full + "]")
+        missing = dict(e)
+        missing.pop("from_email")
+        add("missing required key", json.dumps(missing))
+        add("bad category", json.dumps(dict(e, category="spam")))
+        add("links is a number", json.dumps(dict(e, links=5)))
+        add("non-standard JSON values", json.dumps(e)[:-1] + rng.choice([', "x": NaN}', ', "x": 1e400}', ', "x": "\\ud800"}']))
+        add("non-standard JSON values", json.dumps(dict(e, email_id=12345678901234567890123, difficulty=float("-inf") if i % 5 == 0 else 3)))
+    return corpus
+
+
+def load_recordings(path: str) -> List[tuple]:
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.get("response", "") if isinstance(record, dict) else str(record)
+            corpus.append((path, text))
+    return corpus
+
+
+# ----------------------------
+# Run
+# ----------------------------
+
+def outcome(fn, text):
+    try:
+        return "ok", fn(text).model_dump()
+    except Exception:
+        return "error", None
+
+
+def timed(fn, corpus, repeat, loops=20):
+    """Best-of-`repeat` time for one pass over corpus (each timing averages `loops` passes)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for _, text in corpus:
+                try:
+                    fn(text)
+                except Exception:
+                    pass
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+if __name__ == "__main__":
+    corpus = []
+    for path in sys.argv[1:]:
+        corpus.extend(load_recordings(path))
+    if not corpus:
+        corpus = builtin_corpus()
+
+    codes: Dict[str, int] = {}
+    for kind, text in corpus:
+        old, new = outcome(legacy_validate_and_parse_email, text), outcome(validate_and_parse_email, text)
+        assert old == new, f"Mismatch on {kind}: {text[:120]!r}"
+        if new[0] == "error":
+            try:
+                validate_and_parse_email(text)
+            except Exception as e:
+                code = getattr(e, "code", type(e).__name__)
+                codes[code] = codes.get(code, 0) + 1
+
+    kinds = sorted({kind for kind, _ in corpus})
+    print("=" * 84)
+    print(f"JSON parser: {'orjson' if guardrails.orjson is not None else 'json (stdlib)'}")
+    print(f"{'OUTPUT KIND':<36}{'COUNT':>7}{'LEGACY ms':>14}{'FUSED ms':>13}{'SPEEDUP':>11}")
+    print("=" * 84)
+    for kind in kinds + ["ALL"]:
+        subset = corpus if kind == "ALL" else [c for c in corpus if c[0] == kind]
+        old = timed(legacy_validate_and_parse_email, subset, 5)
+        new = timed(validate_and_parse_email, subset, 5)
+        print(f"{kind[:35]:<36}{len(subset):>7}{old * 1000:>14.3f}{new * 1000:>13.3f}{old / new:>10.1f}x")
+    print("=" * 84)
+    print("Error codes: " + ", ".join(f"{code}={n}" for code, n in sorted(codes.items())))
+    print("All outcomes identical to the legacy validator.")
@@ -0,0 +1,86 @@
+# mock_ollama.py
+# Minimal stand-in for Ollama's /api/generate, for local testing and load tests
+# without a GPU. Returns a valid training email for the category in the prompt.
+#
+#   python mock_ollama.py                # listens on 127.0.0.1:11435
+#   OLLAMA_URL=http://127.0.0.1:11435/api/generate python -m app.main
+#
+# MOCK_OLLAMA_DELAY_S simulates generation latency per request. With "stream": true
+# the email is sent as NDJSON token chunks spread over that delay, followed by
+# MOCK_OLLAMA_TRAILING_TOKENS whitespace tokens (JSON mode often pads until
+# num_predict). MOCK_OLLAMA_BAD_URL_RATE is the fraction of phishing emails
+# that get a link outside the training allowlist.
+
+import os
+import re
+import json
+import random
+import asyncio
+import uvicorn
+from uuid import uuid4
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+MOCK_OLLAMA_PORT = int(os.environ.get("MOCK_OLLAMA_PORT", "11435"))
+MOCK_OLLAMA_DELAY_S = float(os.environ.get("MOCK_OLLAMA_DELAY_S", "0.5"))
+MOCK_OLLAMA_TRAILING_TOKENS = int(os.environ.get("MOCK_OLLAMA_TRAILING_TOKENS", "0"))
+MOCK_OLLAMA_BAD_URL_RATE = float(os.environ.get("MOCK_OLLAMA_BAD_URL_RATE", "0"))
+TOKEN_CHARS = 8
+
+app = FastAPI(title="Mock Ollama")
+
+_CATEGORY = re.compile(r'"category":\s*"(phishing|benign)"')
+
+
+def _link_url() -> str:
+    if random.random() < MOCK_OLLAMA_BAD_URL_RATE:
+        return "https://secure-billing-update.com/login"
+    return "https://tedd.training/verify"
+
+
+def _fake_email(prompt: str) -> dict:
+    match = _CATEGORY.search(prompt)
+    category = match.group(1) if match else "phishing"
+    phishing = category == "phishing"
+    return {
+        "email_id": "",
+        "scenario_id": "",
+        "category": category,
+        "difficulty": 5 if phishing else 1,
+        "subject": "Action required: verify your account" if phishing else "Notes from Monday's meeting",
+        "from_name": "IT Service Desk" if phishing else "Sarah Lim",
+        "from_email": "helpdesk@it-support-portal.com" if phishing else "sarah.lim@example.com",
+        "reply_to": "",
+        "body_text": f"Hello,\n\nThis is mock message {uuid4().hex[:8]}.\n\nRegards",
+        "links": [{"display_text": "Verify now", "url": _link_url()}] if phishing else [],
+        "attachments": [],
+        "intended_red_flags": [],
+        "ground_truth": category,
+        "model_version": "",
+        "prompt_version": "",
+    }
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    text = json.dumps(_fake_email(body.get("prompt", "")))
+    if not body.get("stream", True):
+        await asyncio.sleep(MOCK_OLLAMA_DELAY_S)
+        return {"model": body.get("model"), "response": text, "done": True}
+
+    tokens = [text[i : i + TOKEN_CHARS] for i in range(0, len(text), TOKEN_CHARS)]
+    tokens += ["\n"] * MOCK_OLLAMA_TRAILING_TOKENS
+    per_token_s = MOCK_OLLAMA_DELAY_S / max(1, len(tokens))
+
+    async def token_stream():
+        for token in tokens:
+            await asyncio.sleep(per_token_s)
+            yield json.dumps({"model": body.get("model"), "response": token, "done": False}) + "\n"
+        yield json.dumps({"model": body.get("model"), "response": "", "done": True}) + "\n"
+
+    return StreamingResponse(token_stream(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=MOCK_OLLAMA_PORT)
@@ -0,0 +1,155 @@
+"""
+Dynamic micro-batching for BERT inference.
+
+Concurrent scans each submit a single text; a background worker groups them
+by a max-batch-size / max-wait policy and runs ONE padded forward pass,
+then hands every caller back its own probability row.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence
+
+
+class _PendingText:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BertMicroBatcher:
+    """Groups concurrent single-text requests into padded batches."""
+
+    def __init__(self, forward_fn: Callable[[List[str]], Sequence],
+                 max_batch_size: int = 16, max_wait_ms: float = 10.0, metrics_window: int = 256):
+        # forward_fn takes a list of texts and returns one probability row per text
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        self._recent_batches = deque(maxlen=metrics_window)
+        self._total_batches = 0
+        self._total_items = 0
+        self._total_errors = 0
+
+    # ---------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------
+    def submit(self, text: str) -> Future:
+        """Queues one text and returns a Future resolving to its probability row."""
+        self._ensure_worker()
+        pending = _PendingText(text)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, text: str):
+        """Blocking helper for synchronous callers."""
+        return self.submit(text).result()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            recent = list(self._recent_batches)
+            totals = {
+                "total_batches": self._total_batches,
+                "total_items": self._total_items,
+                "total_errors": self._total_errors,
+            }
+
+        summary = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "queue_depth": self._queue.qsize(),
+            **totals,
+            "avg_batch_size": round(totals["total_items"] / totals["total_batches"], 2) if totals["total_batches"] else 0.0,
+        }
+        if recent:
+            summary["recent"] = {
+                "batches": len(recent),
+                "avg_batch_size": round(sum(b["batch_size"] for b in recent) / len(recent), 2),
+                "avg_queue_wait_ms": round(sum(b["avg_queue_wait_ms"] for b in recent) / len(recent), 2),
+                "max_queue_wait_ms": round(max(b["max_queue_wait_ms"] for b in recent), 2),
+                "avg_forward_ms": round(sum(b["forward_ms"] for b in recent) / len(recent), 2),
+                "last_batch": recent[-1],
+            }
+        return summary
+
+    # ---------------------------------------------------------
+    # Worker
+    # ---------------------------------------------------------
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a forked worker process starts its own
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+            self._worker_pid = pid
+            self._worker = threading.Thread(target=self._run, name="bert-micro-batcher", daemon=True)
+            self._worker.start()
+
+    def _collect_batch(self) -> List[_PendingText]:
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    # Window closed; still sweep up anything that is already waiting
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip callers that were cancelled while waiting in the queue
+            batch = [p for p in batch if p.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            waits = [(started - p.enqueued_at) * 1000 for p in batch]
+            try:
+                probabilities = self.forward_fn([p.text for p in batch])
+            except Exception as e:
+                logging.error(f"❌ BERT micro-batch of {len(batch)} failed: {e}")
+                for p in batch:
+                    p.future.set_exception(e)
+                with self._lock:
+                    self._total_errors += 1
+                continue
+
+            forward_ms = (time.perf_counter() - started) * 1000
+            for p, row in zip(batch, probabilities):
+                p.future.set_result(row)
+
+            stats = {
+                "batch_size": len(batch),
+                "avg_queue_wait_ms": round(sum(waits) / len(waits), 2),
+                "max_queue_wait_ms": round(max(waits), 2),
+                "forward_ms": round(forward_ms, 2),
+            }
+            with self._lock:
+                self._recent_batches.append(stats)
+                self._total_batches += 1
+                self._total_items += len(batch)
+            logging.debug(f"BERT batch: {stats}")
@@ -0,0 +1,307 @@
+"""
+In-process result caches.
+
+LRUCache is a thread-safe LRU with optional TTL and byte budget, and
+ModelFileWatcher tells a cache when the model files behind its entries
+have changed so stale verdicts are dropped instead of served. SqliteCacheTier
+is an optional on-disk tier behind an LRUCache, so expensive entries survive
+restarts and are shared by every worker process on the host.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class LRUCache:
+    """Bounded LRU map with per-entry TTL, an optional size budget and hit/miss counters."""
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl_s: float = 0, max_bytes: int = 0,
+                 sizeof: Optional[Callable[[Any], int]] = None, watcher: Optional["ModelFileWatcher"] = None,
+                 disk: Optional["SqliteCacheTier"] = None):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = max(0.0, float(ttl_s))        # 0 = entries never expire
+        self.max_bytes = max(0, int(max_bytes))    # 0 = no byte budget
+        self.sizeof = sizeof
+        self.watcher = watcher
+        self.disk = disk  # values must be JSON-serializable when a disk tier is attached
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evicted = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        self._check_watcher()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if not expires_at or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                self._drop(key)
+                self._expired += 1
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._put_memory(key, value)
+                with self._lock:
+                    self._disk_hits += 1
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return default
+
+    def put(self, key: Hashable, value: Any):
+        self._put_memory(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _put_memory(self, key: Hashable, value: Any):
+        size = self.sizeof(value) if self.sizeof and self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return  # one entry larger than the whole budget is simply not cached
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else 0
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._invalidations += 1
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _drop(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _check_watcher(self):
+        if self.watcher is not None and self.watcher.changed():
+            logging.info(f"♻️ Model files changed. Clearing {self.name} cache.")
+            self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._hits + self._disk_hits
+            lookups = hits + self._misses
+            stats = {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "hits": hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "invalidations": self._invalidations,
+            }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+class SqliteCacheTier:
+    """
+    Persistent key -> JSON value store with TTL and an entry cap (least
+    recently used rows are pruned). One SQLite file can hold several tables.
+    """
+
+    PRUNE_EVERY = 100  # puts between cap / expiry sweeps
+
+    def __init__(self, path: str, table: str, ttl_s: float = 0, max_entries: int = 100000):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", table):
+            raise ValueError(f"Invalid cache table name: {table}")
+        self.path = path
+        self.table = table
+        self.ttl_s = max(0.0, float(ttl_s))
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                f"expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    def get(self, key: Hashable) -> Any:
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                row = self._conn.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (str(key),)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] and row[1] <= now:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (str(key),))
+                    return None
+                self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, str(key)))
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logging.warning(f"⚠️ Disk cache read failed ({self.table}): {e}")
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        now = time.time()
+        expires_at = now + self.ttl_s if self.ttl_s else 0
+        try:
+            payload = json.dumps(value)
+            with self._lock, self._conn:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (str(key), payload, expires_at, now)
+                )
+                self._puts += 1
+                if self._puts % self.PRUNE_EVERY == 0:
+                    self._prune(now)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.warning(f"⚠️ Disk cache write failed ({self.table}): {e}")
+
+    def _prune(self, now: float):
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at != 0 AND expires_at <= ?", (now,))
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(f"DELETE FROM {self.table}")
+        except sqlite3.Error as e:
+            logging.warning(f"⚠️ Disk cache clear failed ({self.table}): {e}")
+
+    def stats(self) -> Dict:
+        try:
+            with self._lock:
+                (rows,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        except sqlite3.Error:
+            rows = None
+        return {"path": self.path, "entries": rows, "max_entries": self.max_entries, "ttl_s": self.ttl_s}
+
+
+class ModelFileWatcher:
+    """
+    Fingerprints model files/directories by (path, size, mtime). changed() is
+    cheap to call on every lookup: the filesystem is only re-stat'ed once per
+    check_interval_s.
+    """
+
+    def __init__(self, paths: Iterable[str], check_interval_s: float = 5.0):
+        self.paths = list(paths)
+        self.check_interval_s = max(0.0, float(check_interval_s))
+        self._lock = threading.Lock()
+        self._fingerprint = self.fingerprint()
+        self._next_check = time.monotonic() + self.check_interval_s
+
+    def fingerprint(self) -> Tuple:
+        stamps = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+            else:
+                files = [path]
+            for f in files:
+                try:
+                    st = os.stat(f)
+                    stamps.append((f, st.st_size, st.st_mtime_ns))
+                except OSError:
+                    stamps.append((f, None, None))
+        return tuple(stamps)
+
+    def version(self) -> str:
+        """Short digest of the current fingerprint, for keys that outlive the process (disk tiers)."""
+        return hashlib.sha256(repr(self.fingerprint()).encode()).hexdigest()[:16]
+
+    def changed(self) -> bool:
+        """True once per detected change since the previous call."""
+        if time.monotonic() < self._next_check:
+            return False
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval_s
+            current = self.fingerprint()
+            if current == self._fingerprint:
+                return False
+            self._fingerprint = current
+            return True
+
+
+# ============================================================
+# EMAIL CONTENT KEYS
+# ============================================================
+
+# Headers that differ per mailbox / delivery hop but never feed a verdict
+RECIPIENT_HEADERS = {
+    "to", "cc", "bcc", "delivered-to", "x-original-to", "envelope-to", "x-envelope-to",
+    "received", "x-received", "return-path", "authentication-results", "received-spf",
+    "x-forwarded-to", "x-forwarded-for", "x-uid", "status", "x-status", "x-keywords",
+}
+RECIPIENT_HEADER_PREFIXES = ("arc-", "x-gm-", "x-ms-exchange-", "x-microsoft-antispam")
+
+_HEADER_BODY_SPLIT = re.compile(r"\r?\n\r?\n")
+
+
+def email_content_key(raw_email: str) -> str:
+    """
+    SHA-256 of the email with line endings normalized and recipient-specific
+    headers removed, so the same campaign delivered to many mailboxes (or the
+    same message rescanned) maps to one key.
+    """
+    parts = _HEADER_BODY_SPLIT.split(raw_email, maxsplit=1)
+    header_block = parts[0].replace("\r\n", "\n")
+    body = parts[1].replace("\r\n", "\n") if len(parts) > 1 else ""
+
+    kept, skipping = [], False
+    for line in header_block.split("\n"):
+        if line[:1] in (" ", "\t"):
+            # Folded continuation of the previous header
+            if not skipping:
+                kept.append(line)
+            continue
+        name = line.split(":", 1)[0].strip().lower()
+        skipping = name in RECIPIENT_HEADERS or name.startswith(RECIPIENT_HEADER_PREFIXES)
+        if not skipping:
+            kept.append(line)
+
+    digest = hashlib.sha256()
+    digest.update("\n".join(kept).encode("utf-8", errors="surrogatepass"))
+    digest.update(b"\n\n")
+    digest.update(body.encode("utf-8", errors="surrogatepass"))
+    return digest.hexdigest()
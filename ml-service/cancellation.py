@@ -0,0 +1,69 @@
+"""
+Cooperative cancellation for long-running XAI work.
+
+The endpoint owns a CancellationToken and sets it when the client goes away.
+LIME, SHAP and the model stages run on pool threads and call check() at their
+natural break points (between LIME sub-batches, before each SHAP call, before
+each stage), so abandoned work stops within one sub-batch instead of running
+to completion. A stage that misses its deadline gets its own child token, so
+it can be stopped without cancelling the rest of the request.
+"""
+
+import threading
+from typing import Dict, Optional
+
+
+class OperationCancelled(BaseException):
+    """
+    Raised by CancellationToken.check(). Derives from BaseException (like
+    asyncio.CancelledError) so the predictors' `except Exception` handlers
+    don't turn it into an ordinary per-model error.
+    """
+
+
+class CancellationToken:
+    """Thread-safe flag shared between an endpoint and the work it started."""
+
+    def __init__(self, parent: Optional["CancellationToken"] = None):
+        self._event = threading.Event()
+        # A child token is also cancelled when its parent is, but not the other way round
+        self.parent = parent
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def check(self):
+        if self.cancelled:
+            raise OperationCancelled()
+
+
+def raise_if_cancelled(token: Optional[CancellationToken]):
+    if token is not None:
+        token.check()
+
+
+class CancellationStats:
+    """Counts the work that cancellation avoided."""
+
+    FIELDS = ("requests_cancelled", "lime_samples_skipped", "shap_explanations_skipped",
+              "model_stages_skipped", "llm_calls_skipped")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, **counts: int):
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+cancellation_stats = CancellationStats()
@@ -0,0 +1,65 @@
+"""
+Memoized domain resolution on top of tldextract.
+
+The public suffix list is read from the snapshot bundled next to this file
+(public_suffix_list.dat), never from the network, so startup works in an
+air-gapped deployment. To refresh it, replace the file with
+https://publicsuffix.org/list/public_suffix_list.dat.
+
+Tracking links (click.mailchimp..., t.co, ...) repeat across a large share
+of traffic, so suffix lookups are cached per host rather than per URL.
+"""
+
+import os
+import logging
+from pathlib import Path
+from typing import Dict
+
+import tldextract
+from tldextract.remote import lenient_netloc
+
+from cache import LRUCache
+
+PUBLIC_SUFFIX_LIST_PATH = os.environ.get(
+    "PUBLIC_SUFFIX_LIST_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat")
+)
+
+
+def offline_extractor(suffix_list_path: str = PUBLIC_SUFFIX_LIST_PATH) -> tldextract.TLDExtract:
+    """TLDExtract that reads a local suffix list file and has no disk cache or network fetch."""
+    if not os.path.exists(suffix_list_path):
+        logging.warning(f"⚠️ Suffix list {suffix_list_path} not found. Using the snapshot shipped with tldextract.")
+        return tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+    return tldextract.TLDExtract(suffix_list_urls=[Path(suffix_list_path).resolve().as_uri()], cache_dir=None)
+
+
+class DomainResolver:
+    """tldextract with an LRU cache keyed by (lower-cased) host."""
+
+    def __init__(self, extractor=None, max_entries: int = 50000):
+        self.extractor = extractor or offline_extractor()
+        self.cache = LRUCache("domain", max_entries=max_entries)
+
+    def preload(self):
+        """Parses the suffix list now instead of on the first email."""
+        suffix_count = len(self.extractor.tlds)
+        logging.info(f"✅ Public suffix list loaded ({suffix_count} suffixes)")
+
+    def extract(self, url: str):
+        """ExtractResult for the host of url. Host names are case-insensitive, so results are lower-case."""
+        host = lenient_netloc(url).lower()
+        result = self.cache.get(host)
+        if result is None:
+            result = self.extractor(host)
+            self.cache.put(host, result)
+        return result
+
+    def registered_domain(self, url: str) -> str:
+        """'domain.suffix' (e.g. mailchimp.com for click.mailchimp.com), the bare domain/IP if there is no suffix, else ''."""
+        ext = self.extract(url)
+        if not ext.domain:
+            return ""
+        return f"{ext.domain}.{ext.suffix}" if ext.suffix else ext.domain
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
@@ -0,0 +1,115 @@
+"""
+Bounded worker pool for blocking model inference.
+
+The FastAPI handlers are async, but BERT / XGBoost / LIME / SHAP are plain
+synchronous CPU work. Running them here keeps the event loop free, and the
+pending-job cap gives callers back-pressure (InferencePoolFull -> HTTP 429)
+instead of an unbounded queue.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict
+
+
+class InferencePoolFull(Exception):
+    """Raised when every worker is busy and the pending queue is at capacity."""
+
+
+class InferenceExecutor:
+    """Thread- or process-backed executor with a hard cap on queued jobs."""
+
+    def __init__(self, mode: str = "thread", max_workers: int = 4, max_pending: int = 32,
+                 start_method: str = "spawn"):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor mode: {mode}")
+        self.mode = mode
+        self.max_workers = max(1, int(max_workers))
+        # max_pending counts running + queued jobs
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self.start_method = start_method
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    if self.mode == "process":
+                        ctx = multiprocessing.get_context(self.start_method)
+                        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+                    else:
+                        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+                    logging.info(f"✅ Inference executor started ({self.mode}, {self.max_workers} workers, {self.max_pending} max pending)")
+        return self._pool
+
+    def _release(self, future):
+        with self._stats_lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+        self._slots.release()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """Schedules fn on the pool and returns a concurrent Future, or raises InferencePoolFull."""
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise InferencePoolFull(f"Inference queue is full ({self.max_pending} pending jobs)")
+
+        try:
+            future = self._get_pool().submit(partial(fn, *args, **kwargs))
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._in_flight += 1
+        # The slot is held until the job really finishes, even if the awaiting request goes away
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Awaitable wrapper around submit()."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def metrics(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "mode": self.mode,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def executor_from_env() -> InferenceExecutor:
+    return InferenceExecutor(
+        mode=os.environ.get("INFERENCE_EXECUTOR", "thread").lower(),
+        max_workers=int(os.environ.get("INFERENCE_MAX_WORKERS", str(min(4, os.cpu_count() or 1)))),
+        max_pending=int(os.environ.get("INFERENCE_MAX_PENDING", "32")),
+        start_method=os.environ.get("INFERENCE_PROCESS_START_METHOD", "spawn"),
+    )
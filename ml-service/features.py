@@ -13,6 +13,43 @@ import email
 from email.utils import parseaddr
 from pyquery import PyQuery
 from datetime import datetime
+from collections import Counter
+import numpy as np
+
+# Below this length a plain Counter beats the NumPy setup cost (mostly URLs)
+_NUMPY_ENTROPY_MIN_LEN = 2048
+
+
+def shannon_entropy(text: str) -> float:
+    """
+    Shannon entropy (bits, rounded to 3 places) from a single histogram pass.
+    Shared by the HTML, URL and text extractors; replaces the old
+    text.count(c)-per-character loop, which was O(n * distinct chars).
+    """
+    if not text:
+        return 0
+    n = len(text)
+    if n >= _NUMPY_ENTROPY_MIN_LEN:
+        counts = _codepoint_histogram(text)
+        if counts is not None:
+            probs = counts[counts > 0] / n
+            return round(float(-np.sum(probs * np.log(probs) / log(2.0))), 3)
+    probs = [count / n for count in Counter(text).values()]
+    return round(-sum([p * log(p) / log(2.0) for p in probs]), 3)
+
+
+def _codepoint_histogram(text: str):
+    """Character counts via NumPy: bytes for ASCII, UTF-32 code points otherwise."""
+    if text.isascii():
+        return np.bincount(np.frombuffer(text.encode('ascii'), dtype=np.uint8))
+    try:
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    except UnicodeEncodeError:
+        return None  # lone surrogates; let Counter handle it
+    if codes.max() < 0x20000:
+        # Dense table stays under ~1 MB and covers Latin, CJK, Cyrillic, Arabic and most emoji
+        return np.bincount(codes)
+    return np.unique(codes, return_counts=True)[1]
 
 """
 Module to extract relevant features from Email HTML.
@@ -22,28 +59,40 @@ Tailored specifically for phishing detection in email sandboxes.
 import re
 from math import log
 from string import punctuation
-from pyquery import PyQuery
+from pyquery.text import extract_text
+from typing import Union
+from html_document import HTMLDocument
+
+# Combined scanners for the single-pass mode. Every alternative sits in a lookahead,
+# so matches never consume text another counter needs; the totals equal separate re.findall calls.
+_HTML_PATTERN_SCANNER = re.compile(
+    r'(?=(?:(?P<zero_font>font-size:\s*0\s*(?:px|em|pt|rem)?)'
+    r'|(?P<hex>%[0-9a-fA-F]{2})'
+    r'|(?P<base64>data:image/[a-zA-Z]+;base64,)))'
+)
+_XML_WHITESPACE = re.compile(r'[ \t\n\r]+')  # what XPath normalize-space() splits on
+_DOM_FUNCTION_SCANNER = re.compile(
+    r'(?=(?:createelement\s*\(|appendchild\s*\(|document\.write\s*\(|setattribute\s*\())'
+)
 
 class HTMLFeatures:
     """Extracts features specifically targeted at Email HTML anomalies."""
 
-    def __init__(self, html: str):
-        self.html = html.lower()
-        self.pq = PyQuery(html)
+    def __init__(self, html: Union[str, HTMLDocument]):
+        # Reuse the tree parse_raw_email already built instead of parsing again
+        document = html if isinstance(html, HTMLDocument) else HTMLDocument(html)
+        self.html = document.lower
+        self.pq = document.pq
+        if document.parse_error is not None:
+            raise document.parse_error
         # JavaScript is almost never legitimate in an email
         self.suspicious_functions = ['eval', 'unescape', 'document.write', 'innerhtml', 'window.open', 'settimeout']
 
-    def __get_entropy(self, text):
-        if not text:
-            return 0
-        probs = [text.count(c) / len(text) for c in set(text)]
-        return round(-sum([p * log(p) / log(2.0) for p in probs]), 3)
-
     # ---------------------------------------------------------
     # 1. TEXT & CONTENT METRICS (To detect AI-generated or spun spam)
     # ---------------------------------------------------------
     def page_entropy(self):
-        return self.__get_entropy(self.pq.text())
+        return shannon_entropy(self.pq.text())
 
     def html_length(self):
         return len(self.html)
@@ -157,8 +206,128 @@ class HTMLFeatures:
         script_content = self.pq('script').text().lower()
         return sum(len(re.findall(regex, script_content)) for regex in regex_dom)
 
-    def get_features(self):
+    # ---------------------------------------------------------
+    # 6. SINGLE-PASS EXTRACTION
+    # ---------------------------------------------------------
+    def _scan_dom(self):
+        """
+        One walk over the tree collecting everything the selector-based methods
+        above query separately. Tag / attribute matching mirrors the CSS
+        selectors exactly (raw tag names, case-sensitive values).
+        """
+        tags = {t: 0 for t in ('script', 'form', 'input', 'select', 'textarea', 'iframe',
+                               'frame', 'object', 'embed', 'img', 'a')}
+        password_fields = hidden = empty_links = mismatches = 0
+        meta_refresh = 0
+        script_texts = []
+
+        for root in self.pq:
+            for el in root.iter():
+                tag = el.tag
+                if not isinstance(tag, str):
+                    continue  # comments / processing instructions
+
+                # .hidden + #hidden + [visibility="hidden"] + [display="none"] (duplicates count, like PyQuery '+')
+                classes = el.get('class')
+                if classes and 'hidden' in _XML_WHITESPACE.split(classes):
+                    hidden += 1
+                if el.get('id') == 'hidden':
+                    hidden += 1
+                if el.get('visibility') == 'hidden':
+                    hidden += 1
+                if el.get('display') == 'none':
+                    hidden += 1
+
+                if tag not in tags:
+                    if tag == 'meta' and not meta_refresh:
+                        http_equiv = el.get('http-equiv')
+                        if http_equiv and http_equiv.lower() == 'refresh':
+                            meta_refresh = 1
+                    continue
+                tags[tag] += 1
+
+                if tag == 'script':
+                    script_texts.append(extract_text(el))
+                elif tag == 'input' and el.get('type') == 'password':
+                    password_fields += 1
+                elif tag == 'a':
+                    href = el.get('href')
+                    if href is None or href == '#':
+                        empty_links += 1
+                    if href:
+                        text = extract_text(el).strip()
+                        if text and '.' in text and text.lower() not in href.lower():
+                            mismatches += 1
+
+        return {
+            'tags': tags,
+            'password_fields': password_fields,
+            'hidden': hidden,
+            'empty_links': empty_links,
+            'link_text_mismatch': mismatches,
+            'meta_refresh': meta_refresh,
+            'script_content': ' '.join(script_texts).lower(),
+        }
+
+    def _scan_patterns(self):
+        counts = {'zero_font': 0, 'hex': 0, 'base64': 0}
+        for match in _HTML_PATTERN_SCANNER.finditer(self.html):
+            counts[match.lastgroup] += 1
+        return counts
+
+    def get_features_single_pass(self):
+        """
+        Same dictionary as get_features(legacy) but built from one DOM walk,
+        one visible-text extraction and one combined regex scan.
+        """
+        dom = self._scan_dom()
+        tags = dom['tags']
+        patterns = self._scan_patterns()
+
+        text = self.pq.text()
+        html_len = len(self.html)
+        links = tags['a']
+        imgs = tags['img']
+        script_content = dom['script_content']
+
+        return {
+            # Content Metrics
+            'html_page_entropy': shannon_entropy(text),
+            'html_length': html_len,
+            'html_text_length': len(text),
+            'html_text_to_html_ratio': round(len(text) / html_len, 3) if html_len > 0 else 0,
+            'html_words_num': len(text.split()),
+
+            # Email Sandbox Violations
+            'html_script_tags_num': tags['script'],
+            'html_forms_num': tags['form'],
+            'html_inputs_num': tags['input'] + tags['select'] + tags['textarea'],
+            'html_password_fields_num': dom['password_fields'],
+            'html_iframes_num': tags['iframe'] + tags['frame'],
+            'html_objects_embeds_num': tags['object'] + tags['embed'],
+            'html_has_meta_refresh': dom['meta_refresh'],
+
+            # Evasion Tactics
+            'html_hidden_tags_num': dom['hidden'],
+            'html_zero_font_text_num': patterns['zero_font'],
+            'html_hex_encoded_chars': patterns['hex'],
+            'html_base64_images_num': patterns['base64'],
+
+            # Links & Images
+            'html_total_links': links,
+            'html_images_to_links_ratio': round(imgs / links, 3) if links > 0 else imgs,
+            'html_empty_links_num': dom['empty_links'],
+            'html_link_text_mismatch_num': dom['link_text_mismatch'],
+
+            # Malicious Actions
+            'html_suspicious_func_num': sum(1 for i in self.suspicious_functions if i in script_content),
+            'html_dom_mod_func_num': sum(1 for _ in _DOM_FUNCTION_SCANNER.finditer(script_content))
+        }
+
+    def get_features(self, single_pass: bool = True):
         """Compiles all email-specific HTML features into a dictionary for XGBoost."""
+        if single_pass:
+            return self.get_features_single_pass()
         return {
             # Content Metrics
             'html_page_entropy': self.page_entropy(),
@@ -214,9 +383,7 @@ class URLFeatures:
 
     def entropy(self):
         """Calculates URL entropy"""
-        text = self.url.lower()
-        probs = [text.count(c) / len(text) for c in set(text)]
-        return round(-sum([p * log(p) / log(2.0) for p in probs]), 3)
+        return shannon_entropy(self.url.lower())
 
     def length(self):
         """url length"""
@@ -344,9 +511,7 @@ class TextFeatures:
 
     def entropy(self):
         """Calculates text entropy"""
-        text = self.text.lower()
-        probs = [text.count(c) / len(text) for c in set(text)]
-        return round(-sum([p * log(p) / log(2.0) for p in probs]), 3)
+        return shannon_entropy(self.text.lower())
 
     def words_number(self):
         """Returns number of words in the text"""
@@ -0,0 +1,133 @@
+"""
+Parse-once document model for email HTML bodies.
+
+parse_raw_email builds one HTMLDocument per email and every consumer
+(spoof detection, HTMLFeatures, tag counts, BERT body text) reads from the
+same lxml tree instead of re-parsing the markup.
+"""
+
+from functools import cached_property
+from typing import List, Tuple
+
+import lxml.html
+from lxml import etree
+from pyquery import PyQuery
+
+# Strings directly inside these tags are skipped, same as BeautifulSoup's get_text()
+NON_VISIBLE_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+
+def _local_name(el) -> str:
+    """Tag name without an XHTML namespace prefix (PyQuery parses well-formed XHTML as XML)."""
+    return etree.QName(el).localname.lower()
+
+
+def _visible_strings(el, with_tail: bool = False):
+    """Stripped, non-empty text nodes under el in document order."""
+    if isinstance(el.tag, str) and el.text and _local_name(el) not in NON_VISIBLE_TAGS:
+        text = el.text.strip()
+        if text:
+            yield text
+    # Iterating children also visits comments, whose tails are visible text
+    for child in el:
+        yield from _visible_strings(child, with_tail=True)
+    if with_tail and el.tail:
+        tail = el.tail.strip()
+        if tail:
+            yield tail
+
+
+def _get_attr(el, name: str):
+    """
+    Attribute lookup ignoring case. Well-formed markup goes through the XML
+    parser, which keeps attribute names as written (HREF, Href, ...).
+    """
+    value = el.get(name)
+    if value is not None:
+        return value
+    for key, value in el.attrib.items():
+        if etree.QName(key).localname.lower() == name:
+            return value
+    return None
+
+
+def _is_fragment_wrapper(el) -> bool:
+    """
+    True for the <div>/<span> lxml.html.fromstring puts around a multi-node
+    fragment: it is the implied <body> renamed, so it still hangs off <html>.
+    Real elements are either the parse root or sit under <body>.
+    """
+    parent = el.getparent()
+    return (
+        parent is not None
+        and _local_name(parent) == 'html'
+        and _local_name(el) in ('div', 'span')
+    )
+
+
+class HTMLDocument:
+    """One lazily parsed lxml tree shared by everything that reads an HTML body."""
+
+    def __init__(self, html: str):
+        self.html = html
+        # Set when PyQuery itself rejects the markup (HTMLFeatures surfaces it as before)
+        self.parse_error = None
+
+    def __reduce__(self):
+        # lxml trees can't be pickled; ship the markup and re-parse lazily on the other side
+        return (HTMLDocument, (self.html,))
+
+    @cached_property
+    def pq(self) -> PyQuery:
+        """
+        Same parse HTMLFeatures has always used (XML first, lxml.html fallback),
+        so the feature vectors fed to HTMLClassifier do not change.
+        """
+        try:
+            return PyQuery(self.html)
+        except Exception as e:
+            self.parse_error = e
+        # e.g. unicode input carrying an XML encoding declaration; links and text are still usable
+        try:
+            return PyQuery(lxml.html.fromstring(self.html.encode('utf-8', errors='ignore')))
+        except Exception:
+            return PyQuery([])
+
+    @cached_property
+    def lower(self) -> str:
+        return self.html.lower()
+
+    @cached_property
+    def elements(self) -> List:
+        """Every element node in document order (comments / processing instructions excluded)."""
+        return [el for root in self.pq for el in root.iter() if isinstance(el.tag, str)]
+
+    def select(self, selector: str) -> PyQuery:
+        """CSS selection against the shared tree."""
+        return self.pq(selector)
+
+    @cached_property
+    def tag_count(self) -> int:
+        count = len(self.elements)
+        # lxml wraps bare fragments in a synthetic <div>/<span>; that wrapper isn't in the source
+        if len(self.pq) == 1 and _is_fragment_wrapper(self.pq[0]):
+            count -= 1
+        return count
+
+    @cached_property
+    def anchors(self) -> List[Tuple[str, str]]:
+        """(href, visible text) for every <a href=...>, text joined without separators."""
+        found = []
+        for el in self.elements:
+            if _local_name(el) != 'a':
+                continue
+            href = _get_attr(el, 'href')
+            if href is None:
+                continue
+            found.append((href, "".join(_visible_strings(el))))
+        return found
+
+    @cached_property
+    def text(self) -> str:
+        """Visible text as stripped strings joined by spaces (BeautifulSoup get_text(' ', strip=True))."""
+        return " ".join(text for root in self.pq for text in _visible_strings(root))
@@ -0,0 +1,170 @@
+"""
+Asynchronous job queue for the slow XAI pipeline.
+
+/explain-threat runs LIME, SHAP and an LLM call inside one HTTP request. With
+jobs, the client submits an email, gets a job id back immediately and polls
+(or long-polls) for the result. A fixed number of worker tasks caps how many
+heavy explanations run at once. Identical submissions share one job, and
+finished jobs are kept for a retention window and then dropped.
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised when the pending job queue is at capacity."""
+
+
+class XaiJob:
+    __slots__ = ("job_id", "key", "payload", "status", "result", "error",
+                 "created_at", "started_at", "finished_at", "done")
+
+    def __init__(self, key: str, payload: Any):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.payload = payload
+        self.status = "queued"  # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def to_dict(self) -> Dict:
+        info = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "done":
+            info["result"] = self.result
+        elif self.status == "failed":
+            info["error"] = self.error
+        return info
+
+
+class XaiJobQueue:
+    """Bounded asyncio worker pool with de-duplication and result retention."""
+
+    def __init__(self, run_fn: Callable[[Any], Awaitable[Dict]], max_workers: int = 2,
+                 max_queued: int = 100, retention_s: float = 900):
+        self.run_fn = run_fn
+        self.max_workers = max(1, int(max_workers))
+        self.max_queued = max(1, int(max_queued))
+        self.retention_s = max(0.0, float(retention_s))
+
+        self._jobs: Dict[str, XaiJob] = {}
+        self._by_key: Dict[str, XaiJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._submitted = 0
+        self._deduplicated = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    # ---------------------------------------------------------
+    # Lifecycle (called from the FastAPI lifespan)
+    # ---------------------------------------------------------
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._workers = [asyncio.create_task(self._worker(n)) for n in range(self.max_workers)]
+        logging.info(f"✅ XAI job queue started ({self.max_workers} workers, {self.max_queued} max queued)")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ---------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------
+    def submit(self, key: str, payload: Any):
+        """Returns (job, deduplicated). An identical live or retained job is reused."""
+        self._purge_expired()
+        existing = self._by_key.get(key)
+        if existing is not None and existing.status != "failed":
+            self._deduplicated += 1
+            return existing, True
+
+        job = XaiJob(key, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise JobQueueFull(f"XAI job queue is full ({self.max_queued} pending jobs)")
+        self._jobs[job.job_id] = job
+        self._by_key[key] = job
+        self._submitted += 1
+        return job, False
+
+    def get(self, job_id: str) -> Optional[XaiJob]:
+        self._purge_expired()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: XaiJob, timeout_s: float) -> XaiJob:
+        """Long-poll helper: returns once the job finishes or timeout_s passes."""
+        if timeout_s > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout=timeout_s)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    def metrics(self) -> Dict:
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "max_workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "retention_s": self.retention_s,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "retained": statuses.count("done") + statuses.count("failed"),
+            "submitted": self._submitted,
+            "deduplicated": self._deduplicated,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+
+    # ---------------------------------------------------------
+    # Worker
+    # ---------------------------------------------------------
+    async def _worker(self, n: int):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.run_fn(job.payload)
+                job.status = "done"
+                self._completed += 1
+            except asyncio.CancelledError:
+                job.status, job.error = "failed", "Cancelled during shutdown"
+                raise
+            except Exception as e:
+                logging.error(f"❌ XAI job {job.job_id} failed: {e}")
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+                self._failed += 1
+            finally:
+                job.payload = None  # the raw email is no longer needed
+                job.finished_at = time.time()
+                job.done.set()
+                self._queue.task_done()
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.retention_s
+        expired = [job for job in self._jobs.values() if job.finished_at is not None and job.finished_at <= cutoff]
+        for job in expired:
+            del self._jobs[job.job_id]
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
@@ -0,0 +1,213 @@
+"""
+Non-blocking Groq chat client for the threat narratives.
+
+One pooled httpx.AsyncClient is shared for the life of the app. Every call
+has a hard deadline (queueing + all retries), concurrency is capped with a
+semaphore, transient failures are retried with jittered exponential backoff,
+and a circuit breaker stops hammering an upstream that keeps failing. Callers
+catch LLMUnavailable and fall back to canned text.
+
+GROQ_BASE_URL can point at a local stub server for testing.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import httpx
+
+
+class LLMUnavailable(Exception):
+    """The narrative could not be produced (deadline, circuit open, upstream error, no key)."""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one trial call through after `reset_s`."""
+
+    def __init__(self, threshold: int = 5, reset_s: float = 30.0):
+        self.threshold = max(1, int(threshold))
+        self.reset_s = max(0.0, float(reset_s))
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_s else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        # A failed half-open trial re-opens; calls that were already in flight don't extend an open circuit
+        if self._trial_in_flight or (self.opened_at is None and self.failures >= self.threshold):
+            self.trips += 1
+            self.opened_at = time.monotonic()
+            logging.warning(f"⚠️ LLM circuit breaker opened after {self.failures} consecutive failures")
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+
+class AsyncGroqClient:
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, api_key: Optional[str], base_url: str = "https://api.groq.com/openai/v1",
+                 model: str = "llama-3.3-70b-versatile", deadline_s: float = 10.0, max_concurrency: int = 8,
+                 max_retries: int = 2, backoff_base_s: float = 0.25, backoff_max_s: float = 2.0,
+                 breaker_threshold: int = 5, breaker_reset_s: float = 30.0, max_connections: int = 20):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.deadline_s = float(deadline_s)
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base_s = float(backoff_base_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self.max_connections = max(1, int(max_connections))
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_s)
+
+        self._semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stats = dict.fromkeys(("calls", "succeeded", "failed", "retries", "deadline_exceeded", "short_circuited"), 0)
+
+    # ---------------------------------------------------------
+    # Lifecycle (called from the FastAPI lifespan)
+    # ---------------------------------------------------------
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key or ''}"},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.deadline_s),
+            )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------
+    async def chat(self, prompt: str, max_tokens: int = 300, temperature: float = 0.0) -> str:
+        """Message content of the first choice, or LLMUnavailable."""
+        self._stats["calls"] += 1
+        if not self.api_key:
+            self._stats["failed"] += 1
+            raise LLMUnavailable("GROQ_API_KEY is not configured")
+        if not self.breaker.allow():
+            self._stats["short_circuited"] += 1
+            raise LLMUnavailable("Circuit breaker is open")
+
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        deadline = asyncio.get_running_loop().time() + self.deadline_s
+        try:
+            content = await asyncio.wait_for(self._call_with_retries(payload, deadline), timeout=self.deadline_s)
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            self._stats["deadline_exceeded"] += 1
+            self._record_failure()
+            raise LLMUnavailable(f"No answer within {self.deadline_s:.1f}s")
+        except asyncio.CancelledError:
+            self.breaker.release_trial()
+            raise
+        except Exception as e:
+            self._record_failure()
+            raise LLMUnavailable(str(e)) from e
+
+        self.breaker.record_success()
+        self._stats["succeeded"] += 1
+        return content
+
+    def metrics(self) -> Dict:
+        return {
+            **self._stats,
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+    # ---------------------------------------------------------
+    # Internals
+    # ---------------------------------------------------------
+    def _record_failure(self):
+        self._stats["failed"] += 1
+        self.breaker.record_failure()
+
+    async def _call_with_retries(self, payload: Dict, deadline: float) -> str:
+        # wait_for alone is not enough: a cancelled request on a pooled keep-alive
+        # connection can swallow the cancellation, so every attempt (and backoff)
+        # is also bounded by whatever is left of the deadline.
+        loop = asyncio.get_running_loop()
+        await self.start()
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    response = await self._client.post("/chat/completions", json=payload, timeout=remaining)
+                    if response.status_code not in self.RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        return response.json()["choices"][0]["message"]["content"]
+                    error = httpx.HTTPStatusError(f"Upstream returned {response.status_code}",
+                                                  request=response.request, response=response)
+                except httpx.TransportError as e:
+                    error = e
+                if attempt == self.max_retries:
+                    raise error
+                delay = self._backoff(attempt, error)
+                if loop.time() + delay >= deadline:
+                    raise asyncio.TimeoutError()
+                self._stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter; an explicit Retry-After from the upstream is a lower bound
+        delay = random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.backoff_max_s))
+            except ValueError:
+                pass
+        return delay
+
+
+def groq_client_from_env(model: str) -> AsyncGroqClient:
+    return AsyncGroqClient(
+        api_key=os.environ.get("GROQ_API_KEY"),
+        base_url=os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1"),
+        model=model,
+        deadline_s=float(os.environ.get("GROQ_DEADLINE_S", "10")),
+        max_concurrency=int(os.environ.get("GROQ_MAX_CONCURRENCY", "8")),
+        max_retries=int(os.environ.get("GROQ_MAX_RETRIES", "2")),
+        breaker_threshold=int(os.environ.get("GROQ_BREAKER_THRESHOLD", "5")),
+        breaker_reset_s=float(os.environ.get("GROQ_BREAKER_RESET_S", "30")),
+        max_connections=int(os.environ.get("GROQ_MAX_CONNECTIONS", "20")),
+    )
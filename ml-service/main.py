@@ -1,5 +1,7 @@
-from fastapi import FastAPI, HTTPException, Header, Request # 🚀 Added Request
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Header, Request, Query # 🚀 Added Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
 from transformers import BertForSequenceClassification, BertTokenizer
 import torch
 import torch.nn.functional as F
@@ -8,23 +10,31 @@ import logging
 import joblib
 import re
 import email
-import tldextract 
-from bs4 import BeautifulSoup
 from email import policy
 from urllib.parse import urlparse
-from typing import List, Dict
+from typing import List, Dict, Union, Optional, Tuple
 from features import HTMLFeatures, URLFeatures, TeddFeatureExtractor
+from html_document import HTMLDocument
 from collections import Counter
 from dotenv import load_dotenv
-import shap
-from groq import Groq
 from lime.lime_text import LimeTextExplainer
 import numpy as np
 import requests 
 import json
+import asyncio
+from batching import BertMicroBatcher
+from executor import InferencePoolFull, executor_from_env
+from xai import build_tree_explainer, require_explainer, FastLimeTextExplainer
+import hashlib
+from cache import LRUCache, ModelFileWatcher, SqliteCacheTier, email_content_key
+from domains import DomainResolver
+from jobs import XaiJobQueue, JobQueueFull
+from cancellation import CancellationToken, OperationCancelled, raise_if_cancelled, cancellation_stats
+from llm_client import LLMUnavailable, groq_client_from_env
 
 # Initialize LIME Text Explainer globally
 lime_text_explainer = LimeTextExplainer(class_names=['Legitimate', 'Phishing'])
+fast_lime_explainer = FastLimeTextExplainer(lime_text_explainer)
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -32,8 +42,11 @@ logging.basicConfig(level=logging.INFO)
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if not GROQ_API_KEY:
     logging.warning("GROQ_API_KEY is missing from environment variables.")
-else:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+
+# Async pooled client (GROQ_DEADLINE_S / GROQ_MAX_CONCURRENCY / GROQ_MAX_RETRIES / GROQ_BREAKER_*; GROQ_BASE_URL for a stub)
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_FALLBACK_EXPLANATION = "- System unable to generate detailed explanation due to API error."
+groq_client = groq_client_from_env(GROQ_MODEL)
 
 BERT_MODEL_PATH = "./tedd_bert_final"
 URL_MODEL_PATH = "./URLClassifier.joblib"
@@ -41,6 +54,58 @@ HTML_MODEL_PATH = "./HTMLClassifier.joblib"
 XGB_HEADER_MODEL_PATH = "./tedd_xgb_model.joblib"
 EXPECTED_KEY = os.environ["INTERNAL_API_KEY"]
 
+# BERT micro-batching (concurrent scans share one padded forward pass)
+BERT_TEMPERATURE = 2.0
+BERT_BATCHING_ENABLED = os.environ.get("BERT_BATCHING_ENABLED", "true").lower() == "true"
+BERT_MAX_BATCH_SIZE = int(os.environ.get("BERT_MAX_BATCH_SIZE", "16"))
+BERT_MAX_WAIT_MS = float(os.environ.get("BERT_MAX_WAIT_MS", "10"))
+
+# Optional per-stage deadlines for the BERT/URL/HTML fan-out (0 = wait for every stage)
+SCAN_STAGE_DEADLINE_MS = float(os.environ.get("SCAN_STAGE_DEADLINE_MS", "0"))
+XAI_STAGE_DEADLINE_MS = float(os.environ.get("XAI_STAGE_DEADLINE_MS", "0"))
+
+# LIME engine: "fast" (batched + de-duplicated + adaptive early stop) or "standard" (stock LIME)
+LIME_MODE = os.environ.get("LIME_MODE", "fast").lower()
+LIME_NUM_SAMPLES = int(os.environ.get("LIME_NUM_SAMPLES", "500"))
+LIME_BATCH_SIZE = int(os.environ.get("LIME_BATCH_SIZE", "32"))
+LIME_ADAPTIVE = os.environ.get("LIME_ADAPTIVE", "true").lower() == "true"
+LIME_MIN_SAMPLES = int(os.environ.get("LIME_MIN_SAMPLES", "100"))
+
+# Verdict cache for /parse-and-predict (keyed by the email content, recipient headers stripped)
+VERDICT_CACHE_ENABLED = os.environ.get("VERDICT_CACHE_ENABLED", "true").lower() == "true"
+VERDICT_CACHE_MAX_ENTRIES = int(os.environ.get("VERDICT_CACHE_MAX_ENTRIES", "10000"))
+VERDICT_CACHE_MAX_BYTES = int(os.environ.get("VERDICT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+VERDICT_CACHE_TTL_S = float(os.environ.get("VERDICT_CACHE_TTL_S", "3600"))
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "5"))
+
+# Explanation caches: email content -> full XAI result, and prompt evidence -> Groq narrative.
+# XAI_CACHE_DB (a SQLite file path) adds a persistent tier shared across restarts / workers.
+XAI_CACHE_MAX_ENTRIES = int(os.environ.get("XAI_CACHE_MAX_ENTRIES", "1000"))
+XAI_CACHE_TTL_S = float(os.environ.get("XAI_CACHE_TTL_S", "86400"))
+NARRATIVE_CACHE_MAX_ENTRIES = int(os.environ.get("NARRATIVE_CACHE_MAX_ENTRIES", "10000"))
+NARRATIVE_CACHE_TTL_S = float(os.environ.get("NARRATIVE_CACHE_TTL_S", str(7 * 86400)))
+XAI_CACHE_DB = os.environ.get("XAI_CACHE_DB", "")
+XAI_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("XAI_CACHE_DISK_MAX_ENTRIES", "100000"))
+
+# Per-URL feature/risk cache and per-host tldextract cache (tracking links repeat across mail)
+URL_CACHE_MAX_ENTRIES = int(os.environ.get("URL_CACHE_MAX_ENTRIES", "50000"))
+URL_CACHE_TTL_S = float(os.environ.get("URL_CACHE_TTL_S", "86400"))
+DOMAIN_CACHE_MAX_ENTRIES = int(os.environ.get("DOMAIN_CACHE_MAX_ENTRIES", "50000"))
+
+# Bulk scanning (/parse-and-predict/batch)
+BATCH_MAX_EMAILS = int(os.environ.get("BATCH_MAX_EMAILS", "500"))
+BATCH_BERT_SIZE = int(os.environ.get("BATCH_BERT_SIZE", "32"))
+BATCH_STREAM_CHUNK = int(os.environ.get("BATCH_STREAM_CHUNK", "16"))  # emails scored per streamed step
+
+# Asynchronous /explain-threat jobs (submit -> poll), capped at XAI_JOB_WORKERS concurrent explanations
+XAI_JOB_WORKERS = int(os.environ.get("XAI_JOB_WORKERS", "2"))
+XAI_JOB_MAX_QUEUED = int(os.environ.get("XAI_JOB_MAX_QUEUED", "100"))
+XAI_JOB_RETENTION_S = float(os.environ.get("XAI_JOB_RETENTION_S", "900"))
+XAI_JOB_MAX_WAIT_S = float(os.environ.get("XAI_JOB_MAX_WAIT_S", "30"))  # longest long-poll a client may ask for
+
+# How often /explain-threat polls for a client disconnect while LIME/SHAP run
+DISCONNECT_POLL_MS = float(os.environ.get("DISCONNECT_POLL_MS", "50"))
+
 # Load BERT Model
 try:
     tokenizer = BertTokenizer.from_pretrained(BERT_MODEL_PATH)
@@ -57,6 +122,7 @@ try:
     if url_model: logging.info("✅ URL Model loaded successfully!")
 except Exception as e:
     logging.error(f"❌ Error loading URL model: {e}")
+    url_model = None
 
 # Load HTML Model
 try:
@@ -64,6 +130,7 @@ try:
     if html_model: logging.info("✅ HTML Model loaded successfully!")
 except Exception as e:
     logging.error(f"❌ Error loading HTML model: {e}")
+    html_model = None
 
 # Load XGBoost Header Model
 try:
@@ -73,15 +140,99 @@ except Exception as e:
     logging.error(f"❌ Error loading XGBoost Header model: {e}")
     xgb_header_model = None
 
-app = FastAPI()
+# SHAP explainers are built once per model and reused by every request
+url_explainer = build_tree_explainer(url_model, "URL")
+html_explainer = build_tree_explainer(html_model, "HTML")
+xgb_header_explainer = build_tree_explainer(xgb_header_model, "Header")
+
+MODEL_FILES = [BERT_MODEL_PATH, URL_MODEL_PATH, HTML_MODEL_PATH, XGB_HEADER_MODEL_PATH]
+verdict_cache = LRUCache(
+    "verdict", max_entries=VERDICT_CACHE_MAX_ENTRIES, ttl_s=VERDICT_CACHE_TTL_S, max_bytes=VERDICT_CACHE_MAX_BYTES,
+    sizeof=lambda verdict: len(json.dumps(verdict)),
+    watcher=ModelFileWatcher(MODEL_FILES, MODEL_WATCH_INTERVAL_S)
+) if VERDICT_CACHE_ENABLED else None
+
+# Persistent XAI entries carry the version of the models that produced them, so a restart
+# with new model files never serves explanations computed by the old ones
+xai_model_watcher = ModelFileWatcher(MODEL_FILES, MODEL_WATCH_INTERVAL_S)
+XAI_MODEL_VERSION = xai_model_watcher.version()
+xai_cache = LRUCache(
+    "xai", max_entries=XAI_CACHE_MAX_ENTRIES, ttl_s=XAI_CACHE_TTL_S, watcher=xai_model_watcher,
+    disk=SqliteCacheTier(XAI_CACHE_DB, "xai_results", XAI_CACHE_TTL_S, XAI_CACHE_DISK_MAX_ENTRIES) if XAI_CACHE_DB else None
+) if XAI_CACHE_MAX_ENTRIES > 0 else None
+narrative_cache = LRUCache(
+    "narrative", max_entries=NARRATIVE_CACHE_MAX_ENTRIES, ttl_s=NARRATIVE_CACHE_TTL_S,
+    disk=SqliteCacheTier(XAI_CACHE_DB, "narratives", NARRATIVE_CACHE_TTL_S, XAI_CACHE_DISK_MAX_ENTRIES) if XAI_CACHE_DB else None
+) if NARRATIVE_CACHE_MAX_ENTRIES > 0 else None
+
+# Cleared whenever URLClassifier.joblib changes, since the cached risks came from the old model
+url_cache = LRUCache(
+    "url", max_entries=URL_CACHE_MAX_ENTRIES, ttl_s=URL_CACHE_TTL_S,
+    watcher=ModelFileWatcher([URL_MODEL_PATH], MODEL_WATCH_INTERVAL_S)
+) if URL_CACHE_MAX_ENTRIES > 0 else None
+# Suffix list comes from the bundled public_suffix_list.dat (no network), parsed at startup
+domain_resolver = DomainResolver(max_entries=DOMAIN_CACHE_MAX_ENTRIES)
+try:
+    domain_resolver.preload()
+except Exception as e:
+    logging.error(f"❌ Error loading public suffix list: {e}")
+
+# Dedicated pool for blocking model calls (INFERENCE_EXECUTOR=thread|process)
+inference_pool = executor_from_env()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await groq_client.start()
+    xai_jobs.start()
+    yield
+    await xai_jobs.stop()
+    await groq_client.aclose()
+    inference_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(InferencePoolFull)
+async def inference_pool_full_handler(request: Request, exc: InferencePoolFull):
+    logging.warning(f"⚠️ Back-pressure: {exc}")
+    return JSONResponse(status_code=429, content={"detail": "Inference queue is full, retry later"}, headers={"Retry-After": "1"})
+
+@app.exception_handler(JobQueueFull)
+async def xai_job_queue_full_handler(request: Request, exc: JobQueueFull):
+    logging.warning(f"⚠️ Back-pressure: {exc}")
+    return JSONResponse(status_code=429, content={"detail": "XAI job queue is full, retry later"}, headers={"Retry-After": "5"})
 
 class RawEmailInput(BaseModel):
     email_content: str 
 
+class ExplainThreatInput(RawEmailInput):
+    # Optional per-request LIME tuning (server defaults come from LIME_NUM_SAMPLES / LIME_BATCH_SIZE)
+    num_samples: Optional[int] = Field(None, ge=50, le=5000)
+    lime_batch_size: Optional[int] = Field(None, ge=1, le=256)
+
+class BatchEmailInput(BaseModel):
+    emails: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_EMAILS)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the TEDD Phishing Detection API!"}
 
+@app.get("/metrics")
+def metrics_endpoint(x_api_key: str = Header(None)):
+    if x_api_key != EXPECTED_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized internal request")
+    return {
+        "bert_batching": bert_batcher.metrics() if bert_batcher else {"enabled": False},
+        "inference_pool": inference_pool.metrics(),
+        "verdict_cache": verdict_cache.stats() if verdict_cache is not None else {"enabled": False},
+        "url_cache": url_cache.stats() if url_cache is not None else {"enabled": False},
+        "domain_cache": domain_resolver.stats(),
+        "xai_jobs": xai_jobs.metrics(),
+        "cancellation": cancellation_stats.snapshot(),
+        "xai_cache": xai_cache.stats() if xai_cache is not None else {"enabled": False},
+        "narrative_cache": narrative_cache.stats() if narrative_cache is not None else {"enabled": False},
+        "groq": groq_client.metrics(),
+    }
+
 # ============================================================
 # EMAIL PARSING FUNCTIONS
 # ============================================================
@@ -106,28 +257,28 @@ def parse_raw_email(raw_email: str) -> Dict:
 
         urls = []
         is_spoofed = False  
+        html_document = None
         
         if body_text:
             urls.extend(re.findall(r'https?://[^\s<>"]+|www\.[^\s<>"]+', body_text))
 
-        if html_content:
-            soup = BeautifulSoup(html_content, "html.parser")
-            for a in soup.find_all('a', href=True):
-                href = a.get('href', '').strip().strip('\'"')
-                text = a.get_text(strip=True)
+        if html_content.strip():
+            # Parsed once here; features, tag counts and body text all reuse this tree
+            html_document = HTMLDocument(html_content.strip())
+            for raw_href, text in html_document.anchors:
+                href = raw_href.strip().strip('\'"')
                 urls.append(href)
                 
                 clean_text = text.strip().lower()
                 
                 if ' ' not in clean_text and '.' in clean_text:
                     try: 
-                        ext_text = tldextract.extract(clean_text)
-                        ext_href = tldextract.extract(href)
+                        ext_text = domain_resolver.extract(clean_text)
                         
                         if ext_text.domain and ext_text.suffix:
-                            text_base = f"{ext_text.domain}.{ext_text.suffix}"
-                            if ext_href.domain: 
-                                href_base = f"{ext_href.domain}.{ext_href.suffix}" if ext_href.suffix else ext_href.domain
+                            text_base = domain_resolver.registered_domain(clean_text)
+                            href_base = domain_resolver.registered_domain(href)
+                            if href_base: 
                                 if text_base != href_base:
                                     print(f"🚩 SPOOF CAUGHT: Visible Text '{text_base}' -> Hidden Link '{href_base}'")
                                     is_spoofed = True
@@ -145,6 +296,7 @@ def parse_raw_email(raw_email: str) -> Dict:
             "header_details": header_dict,
             "text": body_text.strip(),
             "html": html_content.strip(),
+            "html_document": html_document,
             "urls": list(set(clean_urls)),
             "is_spoofed": is_spoofed, 
             "parsing_status": "success"
@@ -152,6 +304,14 @@ def parse_raw_email(raw_email: str) -> Dict:
     except Exception as e:
         return {"parsing_status": "error", "error": str(e)}
 
+def build_combined_text(parsed_email: Dict) -> str:
+    """Subject + body text fed to BERT (falls back to visible HTML text)."""
+    subject = parsed_email["header_details"].get("subject", "")
+    body_text = parsed_email["text"]
+    if not body_text and parsed_email["html"]:
+        body_text = parsed_email["html_document"].text
+    return f"{subject} {body_text}".strip()
+
 # ============================================================
 # PREDICTION FUNCTIONS (Two-Stage Architecture)
 # ============================================================
@@ -176,92 +336,138 @@ def predict_header_features(raw_email: str) -> Dict:
         # ==========================================
         # SHAP: Extract feature importance for LLaMA
         # ==========================================
-        explainer = shap.TreeExplainer(xgb_header_model)
-        shap_values = explainer.shap_values(feature_array)
-        
-        if isinstance(shap_values, list):
-            instance_shap_values = shap_values[1][0]
-        else:
-            instance_shap_values = shap_values[0]
-
-        shap_explanation_data = [
-            {"feature": feat, "shap_value": float(val)} 
-            for feat, val in zip(feature_extractor.feature_names, instance_shap_values)
-        ]
-        shap_explanation_data.sort(key=lambda x: abs(x["shap_value"]), reverse=True)
+        shap_explanation_data = require_explainer(xgb_header_explainer, "Header").top_features(
+            feature_extractor.feature_names, feature_values
+        )
         
         return {
             "model": "Header",
             "prediction": result,
             "confidence": round(float(confidence), 4),
             "raw_risk": float(raw_risk),
-            "shap_explanation": shap_explanation_data[:5]
+            "shap_explanation": shap_explanation_data
         }
     except Exception as e:
         logging.error(f"Error in header prediction: {e}")
         return {"model": "Header", "error": str(e)}
 
-def predict_text_bert(text: str, run_xai: bool = False) -> Dict:
+def _bert_forward(texts: List[str]) -> np.ndarray:
+    """One padded forward pass; returns temperature-scaled probabilities per text."""
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=512)
+    with torch.no_grad():
+        logits = bert_model(**inputs).logits / BERT_TEMPERATURE
+    return F.softmax(logits, dim=1).numpy()
+
+bert_batcher = BertMicroBatcher(
+    _bert_forward, max_batch_size=BERT_MAX_BATCH_SIZE, max_wait_ms=BERT_MAX_WAIT_MS
+) if bert_model and BERT_BATCHING_ENABLED else None
+
+def check_stage_cancelled(cancel_token: Optional[CancellationToken]):
+    """Called as a stage starts; the job may have sat in the pool queue after its client left."""
+    if cancel_token is not None and cancel_token.cancelled:
+        cancellation_stats.record(model_stages_skipped=1)
+        raise OperationCancelled()
+
+def explain_text_lime(clean_text: str, num_samples: Optional[int] = None, batch_size: Optional[int] = None,
+                      cancel_token: Optional[CancellationToken] = None) -> Dict:
+    """Top-5 LIME words for the BERT verdict, using the engine selected by LIME_MODE."""
+    num_samples = num_samples or LIME_NUM_SAMPLES
+    if LIME_MODE == "standard":
+        # Stock LIME scores every sample in one call, so it can only be stopped before that call
+        def classifier_fn(texts):
+            if cancel_token is not None and cancel_token.cancelled:
+                cancellation_stats.record(lime_samples_skipped=len(texts))
+                raise OperationCancelled()
+            return _bert_forward(texts)
+        exp = lime_text_explainer.explain_instance(clean_text, classifier_fn, num_features=5, num_samples=num_samples)
+        return {"lime_explanation": [{"word": word, "weight": float(weight)} for word, weight in exp.as_list()]}
+
+    words, stats = fast_lime_explainer.explain(
+        clean_text, _bert_forward, num_features=5, num_samples=num_samples,
+        batch_size=batch_size or LIME_BATCH_SIZE, adaptive=LIME_ADAPTIVE,
+        min_samples=min(LIME_MIN_SAMPLES, num_samples), cancel_token=cancel_token
+    )
+    return {
+        "lime_explanation": [{"word": word, "weight": weight} for word, weight in words],
+        "lime_stats": stats
+    }
+
+def clean_bert_text(text: str) -> str:
+    return " ".join(text.split())[:1000]
+
+def predict_text_bert(text: str, run_xai: bool = False, lime_options: Optional[Dict] = None,
+                      probabilities: Optional[np.ndarray] = None, cancel_token: Optional[CancellationToken] = None) -> Dict:
+    """probabilities can be passed in when the caller already scored the text in a larger batch."""
     if not bert_model: return {"model": "BERT", "error": "Model not loaded"}
+    check_stage_cancelled(cancel_token)
     try:
         word_count = len(text.split())
-        clean_text = " ".join(text.split())[:1000] 
-        inputs = tokenizer(clean_text, return_tensors="pt", truncation=True, padding=True, max_length=512)
-        with torch.no_grad():
-            outputs = bert_model(**inputs)
+        clean_text = clean_bert_text(text)
+        if probabilities is None:
+            probabilities = bert_batcher.predict(clean_text) if bert_batcher else _bert_forward([clean_text])[0]
+        predicted_class = int(np.argmax(probabilities))
+        confidence = float(probabilities[predicted_class])
         
-        temperature = 2.0 
-        logits = outputs.logits / temperature
-        probabilities = F.softmax(logits, dim=1)
-        confidence, predicted_class = torch.max(probabilities, dim=1)
-        
-        result = "Phishing" if predicted_class.item() == 1 else "Legitimate"
-        raw_risk = confidence.item() if result == "Phishing" else (1.0 - confidence.item())
+        result = "Phishing" if predicted_class == 1 else "Legitimate"
+        raw_risk = confidence if result == "Phishing" else (1.0 - confidence)
 
         result_dict = {
             "model": "BERT", 
             "prediction": result, 
-            "confidence": round(float(confidence.item()), 4), 
+            "confidence": round(confidence, 4), 
             "raw_risk": float(raw_risk), 
             "word_count": word_count
         }
 
         if run_xai:
-            def predictor_for_lime(texts):
-                lime_inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=512)
-                with torch.no_grad():
-                    lime_probs = F.softmax(bert_model(**lime_inputs).logits / temperature, dim=1).numpy()
-                return lime_probs
-
-            exp = lime_text_explainer.explain_instance(clean_text, predictor_for_lime, num_features=5, num_samples=500)
-            result_dict["lime_explanation"] = [{"word": word, "weight": float(weight)} for word, weight in exp.as_list()]
+            result_dict.update(explain_text_lime(clean_text, cancel_token=cancel_token, **(lime_options or {})))
 
         return result_dict
     except Exception as e:
         return {"model": "BERT", "error": str(e)}
 
-def predict_url_features(urls: List[str], run_xai: bool = False) -> Dict:
+def score_urls(urls: List[str]) -> List[Tuple[Dict, np.ndarray]]:
+    """(feature dict, probability row) per URL. Known links come from the URL cache; the rest share ONE predict_proba call."""
+    scored = {u: url_cache.get(u) for u in set(urls)} if url_cache is not None else dict.fromkeys(urls)
+    missing = [u for u, entry in scored.items() if entry is None]
+    if missing:
+        fresh_features = [URLFeatures(u).get_features() for u in missing]
+        fresh_rows = url_model.predict_proba([list(fd.values()) for fd in fresh_features])
+        for u, features_dict, probabilities in zip(missing, fresh_features, fresh_rows):
+            # Cached before the per-email domain penalty, which depends on the other links
+            scored[u] = (features_dict, probabilities)
+            if url_cache is not None: url_cache.put(u, scored[u])
+    return [scored[u] for u in urls]
+
+def predict_url_features(urls: List[str], run_xai: bool = False, scored: Optional[List[Tuple[Dict, np.ndarray]]] = None,
+                         cancel_token: Optional[CancellationToken] = None) -> Dict:
+    """scored can be passed in when the caller already ran score_urls() over a larger batch."""
     if not url_model: return {"model": "URL", "error": "Model not loaded"}
+    check_stage_cancelled(cancel_token)
     try:
         if not urls: return {"model": "URL", "prediction": "Legitimate", "confidence": 0.0, "raw_risk": 0.0}
 
-        domain_counts = Counter([urlparse(u).netloc.lower() for u in urls])
-        unique_domains = len(set([urlparse(u).netloc.lower() for u in urls if urlparse(u).netloc]))
+        # Grouped by exact host: subdomains of one attacker domain (login.evil.com, pay.evil.com)
+        # must not share the repeated-link discount below
+        hosts = [urlparse(u).netloc.lower() for u in urls]
+        domain_counts = Counter(hosts)
+        unique_domains = len(set([h for h in hosts if h]))
         all_results = []
 
         max_risk_tracked = -1.0
         riskiest_features_dict = {}
+
+        if scored is None:
+            scored = score_urls(urls)
+        classes = getattr(url_model, "classes_", np.arange(len(scored[0][1])))
         
-        for url in urls:
-            features_dict = URLFeatures(url).get_features()
-            features_list = [list(features_dict.values())]
-            
-            prediction = url_model.predict(features_list)[0]
-            probabilities = url_model.predict_proba(features_list)[0]
+        for (features_dict, probabilities), host in zip(scored, hosts):
+            # Same decision predict() makes: the most probable class
+            prediction = classes[int(np.argmax(probabilities))]
             confidence = float(max(probabilities))
             risk = confidence if prediction == 1 else (1.0 - confidence)
 
-            if domain_counts[urlparse(url).netloc.lower()] >= 3:
+            if domain_counts[host] >= 3:
                 risk = risk * 0.4
             
             all_results.append(risk)
@@ -291,37 +497,35 @@ def predict_url_features(urls: List[str], run_xai: bool = False) -> Dict:
             feature_names = list(riskiest_features_dict.keys())
             feature_values = list(riskiest_features_dict.values())
             
-            explainer = shap.TreeExplainer(url_model)
-            shap_values = explainer.shap_values(np.array([feature_values]))
-            
-            if isinstance(shap_values, list):
-                instance_shap_values = shap_values[1][0]
-            else:
-                instance_shap_values = shap_values[0]
-
-            shap_explanation_data = [
-                {"feature": feat, "shap_value": float(val)} 
-                for feat, val in zip(feature_names, instance_shap_values)
-            ]
-            shap_explanation_data.sort(key=lambda x: abs(x["shap_value"]), reverse=True)
-            result_dict["shap_explanation"] = shap_explanation_data[:5]
+            result_dict["shap_explanation"] = require_explainer(url_explainer, "URL").top_features(
+                feature_names, feature_values, cancel_token=cancel_token
+            )
 
         return result_dict
     except Exception as e:
         return {"model": "URL", "error": str(e)}
 
-def predict_html_features(html_text: str, run_xai: bool = False) -> Dict:
+def predict_html_features(html: Union[str, HTMLDocument], run_xai: bool = False,
+                          scored: Optional[Tuple[Dict, np.ndarray]] = None, cancel_token: Optional[CancellationToken] = None) -> Dict:
+    """scored = (feature dict, probability row) when the caller already ran the model over a larger batch."""
     if not html_model: return {"model": "HTML", "error": "Model not loaded"}
+    check_stage_cancelled(cancel_token)
     try:
-        if not html_text.strip(): return {"model": "HTML", "prediction": "No HTML", "confidence": 0.0, "raw_risk": 0.0}
+        document = html if isinstance(html, HTMLDocument) else HTMLDocument(html)
+        if not document.html.strip(): return {"model": "HTML", "prediction": "No HTML", "confidence": 0.0, "raw_risk": 0.0}
         
-        tag_count = len(BeautifulSoup(html_text, "html.parser").find_all()) if html_text.strip() else 0
-        features_dict = HTMLFeatures(html_text).get_features()
+        tag_count = document.tag_count
+        if scored is None:
+            features_dict = HTMLFeatures(document).get_features()
+            scored = (features_dict, html_model.predict_proba([list(features_dict.values())])[0])
+        features_dict, probabilities = scored
         feature_names = list(features_dict.keys())
         feature_values = list(features_dict.values())
         
-        prediction = html_model.predict([feature_values])[0]
-        confidence = float(max(html_model.predict_proba([feature_values])[0]))
+        # Same decision predict() makes: the most probable class
+        classes = getattr(html_model, "classes_", np.arange(len(probabilities)))
+        prediction = classes[int(np.argmax(probabilities))]
+        confidence = float(max(probabilities))
         
         result = "Phishing" if int(prediction) == 1 else "Legitimate"
         raw_risk = confidence if result == "Phishing" else (1.0 - confidence)
@@ -335,25 +539,79 @@ def predict_html_features(html_text: str, run_xai: bool = False) -> Dict:
         }
         
         if run_xai:
-            explainer = shap.TreeExplainer(html_model)
-            shap_values = explainer.shap_values(np.array([feature_values]))
-            
-            if isinstance(shap_values, list):
-                instance_shap_values = shap_values[1][0]
-            else:
-                instance_shap_values = shap_values[0]
-
-            shap_explanation_data = [
-                {"feature": feat, "shap_value": float(val)} 
-                for feat, val in zip(feature_names, instance_shap_values)
-            ]
-            shap_explanation_data.sort(key=lambda x: abs(x["shap_value"]), reverse=True)
-            result_dict["shap_explanation"] = shap_explanation_data[:5]
+            result_dict["shap_explanation"] = require_explainer(html_explainer, "HTML").top_features(
+                feature_names, feature_values, cancel_token=cancel_token
+            )
             
         return result_dict
     except Exception as e:
         return {"model": "HTML", "error": str(e)}
 
+# ============================================================
+# STAGE FAN-OUT / FAN-IN
+# ============================================================
+
+async def run_bert_stage(text: str, run_xai: bool = False, **kwargs) -> Dict:
+    """
+    BERT stage of run_prediction_stages. The text is handed to the micro-batcher
+    straight from the event loop: waiting inside a pool worker would cap every
+    batch at INFERENCE_MAX_WORKERS (and at 1 per process in process mode).
+    Only the LIME explanation still needs a pool worker.
+    """
+    if not bert_batcher:
+        return await inference_pool.run(predict_text_bert, text, run_xai=run_xai, **kwargs)
+    try:
+        probabilities = await asyncio.wrap_future(bert_batcher.submit(clean_bert_text(text)))
+    except Exception as e:
+        return {"model": "BERT", "error": str(e)}
+    if run_xai:
+        return await inference_pool.run(predict_text_bert, text, run_xai=True, probabilities=probabilities, **kwargs)
+    return predict_text_bert(text, probabilities=probabilities)
+
+async def run_prediction_stages(parsed_email: Dict, combined_text: str, run_xai: bool = False, deadline_ms: float = 0,
+                                lime_options: Optional[Dict] = None, cancel_token: Optional[CancellationToken] = None) -> List[Dict]:
+    """
+    Runs the independent BERT / URL / HTML stages in parallel on the inference pool.
+    A stage that misses deadline_ms is reported as an "error" entry, so the
+    ensemble simply scores without that model. Raises OperationCancelled once
+    cancel_token is set.
+
+    In thread mode a late stage is also stopped at its next cancellation check
+    (LIME sub-batch, SHAP call), which frees its pool slot. Process workers
+    can't see tokens, so there a late stage runs to completion in the background
+    and holds its slot until it does.
+    """
+    thread_workers = inference_pool.mode == "thread"
+    stages = []
+    if combined_text: stages.append(("BERT", run_bert_stage, combined_text, {"lime_options": lime_options}))
+    if parsed_email["urls"]: stages.append(("URL", predict_url_features, parsed_email["urls"], {}))
+    if parsed_email["html"]: stages.append(("HTML", predict_html_features, parsed_email["html_document"], {}))
+
+    async def run_stage(model: str, predictor, payload, extra_kwargs: Dict):
+        raise_if_cancelled(cancel_token)
+        # Thread workers get a per-stage token chained to the request's, so a missed deadline
+        # stops just this stage; process workers can't see it, so there cancellation only
+        # takes effect between stages
+        stage_token = None
+        if thread_workers and (deadline_ms or cancel_token is not None):
+            stage_token = CancellationToken(parent=cancel_token)
+            extra_kwargs = {**extra_kwargs, "cancel_token": stage_token}
+        if asyncio.iscoroutinefunction(predictor):
+            pending = predictor(payload, run_xai=run_xai, **extra_kwargs)
+        else:
+            pending = inference_pool.run(predictor, payload, run_xai=run_xai, **extra_kwargs)
+        if not deadline_ms:
+            return await pending
+        try:
+            return await asyncio.wait_for(pending, timeout=deadline_ms / 1000.0)
+        except asyncio.TimeoutError:
+            if stage_token is not None:
+                stage_token.cancel()
+            logging.warning(f"⏱️ {model} stage missed its {deadline_ms:.0f} ms deadline. Scoring without it.")
+            return {"model": model, "error": f"Stage deadline of {deadline_ms:.0f} ms exceeded"}
+
+    return list(await asyncio.gather(*(run_stage(*stage) for stage in stages)))
+
 # ============================================================
 # CONTEXT-AWARE ENSEMBLE SCORING 
 # ============================================================
@@ -393,7 +651,7 @@ def calculate_total_phishing_score(predictions: List[Dict], is_spoofed: bool = F
     
     if is_zero_payload:
         print("🚩 HEURISTIC: Zero-Payload detected. Shifting weight to BERT.")
-        dynamic_weights = {'URL': 0.05, 'BERT': 0.90, 'HTML': 0.05}
+        dynamic_weights = {'Header': 0.0, 'URL': 0.05, 'BERT': 0.90, 'HTML': 0.05}
         if risks['BERT'] > 0.40:
              dynamic_weights['BERT'] = 0.95
 
@@ -462,6 +720,174 @@ def calculate_total_phishing_score(predictions: List[Dict], is_spoofed: bool = F
         "raw_risk_data": {m: round(risks[m], 4) for m in models}
     }
 
+def score_verdict(cache_key: Optional[str], predictions: List[Dict], is_spoofed: bool) -> Dict:
+    """Ensemble verdict for one email, stored in the verdict cache when every stage succeeded."""
+    response = {"combined_analysis": calculate_total_phishing_score(predictions, is_spoofed)}
+    # A verdict missing a stage (error / missed deadline) is not cached, so the next scan can complete it
+    if cache_key and not any("error" in p for p in predictions):
+        verdict_cache.put(cache_key, response)
+    return response
+
+# ============================================================
+# BATCH SCANNING (many emails, one model call per stage)
+# ============================================================
+
+def parse_email_chunk(raw_emails: List[str]) -> List[Dict]:
+    """parse_raw_email + build_combined_text for a slice of a batch (one pool job per slice)."""
+    parsed_emails = []
+    for raw_email in raw_emails:
+        parsed_email = parse_raw_email(raw_email)
+        if parsed_email["parsing_status"] == "success":
+            parsed_email["combined_text"] = build_combined_text(parsed_email)
+        parsed_emails.append(parsed_email)
+    return parsed_emails
+
+def predict_text_bert_batch(texts: List[str]) -> List[Dict]:
+    """BERT verdicts for many emails, in length-sorted padded batches of BATCH_BERT_SIZE."""
+    if not bert_model: return [{"model": "BERT", "error": "Model not loaded"} for _ in texts]
+    clean_texts = [clean_bert_text(t) for t in texts]
+    rows = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(clean_texts[i]))
+    for start in range(0, len(order), BATCH_BERT_SIZE):
+        chunk = order[start:start + BATCH_BERT_SIZE]
+        try:
+            for i, row in zip(chunk, _bert_forward([clean_texts[i] for i in chunk])):
+                rows[i] = row
+        except Exception as e:
+            logging.error(f"❌ BERT batch of {len(chunk)} failed: {e}")
+            for i in chunk: rows[i] = e
+    return [
+        {"model": "BERT", "error": str(row)} if isinstance(row, Exception) else predict_text_bert(text, probabilities=row)
+        for text, row in zip(texts, rows)
+    ]
+
+def predict_url_features_batch(url_lists: List[List[str]]) -> List[Dict]:
+    """URL verdicts for many emails; every distinct link in the batch is scored once."""
+    if not url_model: return [{"model": "URL", "error": "Model not loaded"} for _ in url_lists]
+    try:
+        unique_urls = list({u for urls in url_lists for u in urls})
+        scored = dict(zip(unique_urls, score_urls(unique_urls)))
+    except Exception as e:
+        return [{"model": "URL", "error": str(e)} for _ in url_lists]
+    return [predict_url_features(urls, scored=[scored[u] for u in urls]) for urls in url_lists]
+
+def predict_html_features_batch(documents: List[HTMLDocument]) -> List[Dict]:
+    """HTML verdicts for many emails with ONE predict_proba call over every feature vector."""
+    if not html_model: return [{"model": "HTML", "error": "Model not loaded"} for _ in documents]
+    features = {}
+    for i, document in enumerate(documents):
+        try:
+            if document.html.strip(): features[i] = HTMLFeatures(document).get_features()
+        except Exception as e:
+            features[i] = e
+    valid = [i for i, fd in features.items() if not isinstance(fd, Exception)]
+    try:
+        rows = dict(zip(valid, html_model.predict_proba([list(features[i].values()) for i in valid]))) if valid else {}
+    except Exception as e:
+        return [{"model": "HTML", "error": str(e)} for _ in documents]
+
+    results = []
+    for i, document in enumerate(documents):
+        if isinstance(features.get(i), Exception):
+            results.append({"model": "HTML", "error": str(features[i])})
+        else:
+            results.append(predict_html_features(document, scored=(features[i], rows[i]) if i in rows else None))
+    return results
+
+async def scan_email_batch(raw_emails: List[str], index_offset: int = 0) -> List[Dict]:
+    """
+    Fast-scan verdicts for many emails, in input order. Cache hits are answered
+    directly; the rest are parsed in parallel slices on the inference pool,
+    then each model runs ONCE over all of them. Failures are per item.
+    """
+    results = [None] * len(raw_emails)
+    cache_keys = [email_content_key(e) if verdict_cache is not None else None for e in raw_emails]
+    pending = []
+    for i, key in enumerate(cache_keys):
+        cached = verdict_cache.get(key) if key else None
+        if cached is not None:
+            results[i] = {"index": index_offset + i, **cached}
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    slices = [pending[k::inference_pool.max_workers] for k in range(min(inference_pool.max_workers, len(pending)))]
+    parsed_slices = await asyncio.gather(*(inference_pool.run(parse_email_chunk, [raw_emails[i] for i in chunk]) for chunk in slices))
+    parsed = {i: p for chunk, parsed_chunk in zip(slices, parsed_slices) for i, p in zip(chunk, parsed_chunk)}
+
+    scannable = []
+    for i in pending:
+        if parsed[i]["parsing_status"] == "error":
+            results[i] = {"index": index_offset + i, "error": "Parsing failed"}
+        else:
+            scannable.append(i)
+
+    # Same stage selection as run_prediction_stages, but each stage is one job for the whole batch
+    stage_inputs = [
+        (predict_text_bert_batch, [i for i in scannable if parsed[i]["combined_text"]], lambda p: p["combined_text"]),
+        (predict_url_features_batch, [i for i in scannable if parsed[i]["urls"]], lambda p: p["urls"]),
+        (predict_html_features_batch, [i for i in scannable if parsed[i]["html"]], lambda p: p["html_document"]),
+    ]
+    stage_results = await asyncio.gather(*(
+        inference_pool.run(predictor, [payload(parsed[i]) for i in indices])
+        for predictor, indices, payload in stage_inputs if indices
+    ))
+
+    predictions = {i: [] for i in scannable}
+    for (_, indices, _), stage_result in zip([s for s in stage_inputs if s[1]], stage_results):
+        for i, prediction in zip(indices, stage_result):
+            predictions[i].append(prediction)
+
+    for i in scannable:
+        try:
+            verdict = score_verdict(cache_keys[i], predictions[i], parsed[i].get("is_spoofed", False))
+            results[i] = {"index": index_offset + i, **verdict}
+        except Exception as e:
+            results[i] = {"index": index_offset + i, "error": str(e)}
+    return results
+
+# ============================================================
+# LLM NARRATIVE (Groq)
+# ============================================================
+
+def build_threat_prompt(is_spoofed: bool, bad_words: List[str]) -> str:
+    return f"""
+    You are a cybersecurity AI explaining a phishing alert to a non-technical user.
+    
+    EVIDENCE DETECTED:
+    - Link Spoofing: {is_spoofed}
+    - Suspicious Text Lures: {bad_words}
+    
+    FORMATTING & CONTENT RULES:
+    1. Output a STRICT bulleted list using '- '. Do not write an intro or outro paragraph. Maximum 3 bullets.
+    2. Analyze the EVIDENCE provided:
+       - If Link Spoofing is True, explain that a visible link is deceptively hiding its true destination. IF FALSE, DO NOT MENTION SPOOFING OR LINKS AT ALL.
+       - If Suspicious Text Lures are present, mentally filter out brand names and URL artifacts (like 'roblox', 'google', 'com', 'http'). Name the remaining words and identify the specific psychological tactic the attacker is using (e.g., creating false urgency, posing as an authority, offering a fake reward, or inducing fear).
+       - If neither Spoofing nor Text Lures are present, explain that the email's hidden code and structure matched known malicious patterns.
+    3. Actionable Advice: The final bullet point MUST start with "Advice: " and provide one sentence telling the user exactly what to do or check based on the specific threats found.
+    4. ZERO technical jargon. Do not mention SHAP, LIME, HTML, URLs, models, or weights.
+    """
+
+async def generate_threat_explanation(is_spoofed: bool, bad_words: List[str]) -> str:
+    prompt = build_threat_prompt(is_spoofed, bad_words)
+    # temperature=0: the same evidence (and prompt / model) always gets the same narrative
+    cache_key = hashlib.sha256(f"{GROQ_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+    if narrative_cache is not None:
+        cached = narrative_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    try:
+        explanation = await groq_client.chat(prompt, max_tokens=300, temperature=0.0)
+    except LLMUnavailable as e:
+        logging.error(f"❌ Error communicating with Groq API: {e}")
+        return GROQ_FALLBACK_EXPLANATION
+
+    if narrative_cache is not None and explanation:
+        narrative_cache.put(cache_key, explanation)
+    return explanation
+
 # ============================================================
 # API ENDPOINTS
 # ============================================================
@@ -476,57 +902,106 @@ async def parse_and_predict_endpoint(
     if x_api_key != EXPECTED_KEY:
         raise HTTPException(status_code=403, detail="Unauthorized internal request")
     
-    parsed_email = parse_raw_email(raw_email.email_content)
+    # Rescans and the same campaign hitting many mailboxes skip the models entirely
+    cache_key = email_content_key(raw_email.email_content) if verdict_cache is not None else None
+    if cache_key:
+        cached = verdict_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    parsed_email = await inference_pool.run(parse_raw_email, raw_email.email_content)
     if parsed_email["parsing_status"] == "error":
         raise HTTPException(status_code=400, detail="Parsing failed")
         
-    subject = parsed_email["header_details"].get("subject", "")
-    body_text = parsed_email["text"]
-    if not body_text and parsed_email["html"]:
-        body_text = BeautifulSoup(parsed_email["html"], "html.parser").get_text(separator=' ', strip=True)
-
-    combined_text = f"{subject} {body_text}".strip()
+    combined_text = await inference_pool.run(build_combined_text, parsed_email)
     
-    predictions = []
-    # Fast scan - no XAI
-    if combined_text: predictions.append(predict_text_bert(combined_text))
-    if parsed_email["urls"]: predictions.append(predict_url_features(parsed_email["urls"]))
-    if parsed_email["html"]: predictions.append(predict_html_features(parsed_email["html"]))
+    # Fast scan - no XAI (stages run in parallel on the inference pool)
+    predictions = await run_prediction_stages(parsed_email, combined_text, deadline_ms=SCAN_STAGE_DEADLINE_MS)
     
-    total_result = calculate_total_phishing_score(predictions, parsed_email.get("is_spoofed", False))
-    return {"combined_analysis": total_result}
+    return score_verdict(cache_key, predictions, parsed_email.get("is_spoofed", False))
 
-# 2. The Deep XAI Analysis (THE SLOW ENDPOINT)
-@app.post("/explain-threat")
-async def explain_threat_endpoint(
-    request: Request,                   # 🚀 Added Request
-    raw_email: RawEmailInput, 
+# 1b. Bulk Scan (whole mailbox in one call)
+@app.post("/parse-and-predict/batch")
+async def parse_and_predict_batch_endpoint(
+    request: Request,
+    batch: BatchEmailInput, 
     x_api_key: str = Header(None)
 ):
     if x_api_key != EXPECTED_KEY:
         raise HTTPException(status_code=403, detail="Unauthorized internal request")
-    
-    parsed_email = parse_raw_email(raw_email.email_content)
+
+    results = await scan_email_batch(batch.emails)
+    return {"count": len(results), "results": results}
+
+# 1c. Streaming Bulk Scan (one NDJSON line per email as soon as its verdict is ready)
+@app.post("/parse-and-predict/stream")
+async def parse_and_predict_stream_endpoint(
+    request: Request,
+    batch: BatchEmailInput, 
+    x_api_key: str = Header(None)
+):
+    if x_api_key != EXPECTED_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized internal request")
+
+    async def verdict_lines():
+        emails = batch.emails
+        for start in range(0, len(emails), BATCH_STREAM_CHUNK):
+            # 🚀 DISCONNECTION CHECK: the UI went away, don't score the rest of the mailbox
+            if await request.is_disconnected():
+                logging.info(f"🚀 Client disconnected after {start}/{len(emails)} emails. Stopping stream.")
+                return
+            for result in await scan_email_batch(emails[start:start + BATCH_STREAM_CHUNK], index_offset=start):
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(verdict_lines(), media_type="application/x-ndjson")
+
+# 2. The Deep XAI Analysis (THE SLOW ENDPOINT)
+async def watch_disconnect(request: Request, cancel_token: CancellationToken):
+    while not cancel_token.cancelled:
+        if await request.is_disconnected():
+            cancel_token.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_MS / 1000.0)
+
+def explain_request_key(raw_email: ExplainThreatInput) -> str:
+    """Same email content + same LIME options = same explanation."""
+    return f"{email_content_key(raw_email.email_content)}:{raw_email.num_samples}:{raw_email.lime_batch_size}"
+
+async def run_explain_threat(raw_email: ExplainThreatInput, request: Optional[Request] = None) -> Dict:
+    """LIME/SHAP stages + Groq narrative. request is None for queued jobs (nobody to disconnect)."""
+    # Repeat explanations of the same campaign skip LIME, SHAP and the LLM call
+    cache_key = f"{explain_request_key(raw_email)}:{XAI_MODEL_VERSION}" if xai_cache is not None else None
+    if cache_key:
+        cached = xai_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    parsed_email = await inference_pool.run(parse_raw_email, raw_email.email_content)
     if parsed_email["parsing_status"] == "error":
         raise HTTPException(status_code=400, detail="Parsing failed")
         
-    subject = parsed_email["header_details"].get("subject", "")
-    body_text = parsed_email["text"]
-    if not body_text and parsed_email["html"]:
-        body_text = BeautifulSoup(parsed_email["html"], "html.parser").get_text(separator=' ', strip=True)
-
-    combined_text = f"{subject} {body_text}".strip()
+    combined_text = await inference_pool.run(build_combined_text, parsed_email)
     is_spoofed = parsed_email.get("is_spoofed", False)
 
     # 🚀 DISCONNECTION CHECK 1: Before expensive LIME/SHAP
-    if await request.is_disconnected():
+    if request is not None and await request.is_disconnected():
         logging.info("🚀 Client disconnected before XAI logic. Skipping.")
+        cancellation_stats.record(requests_cancelled=1)
         return {"status": "cancelled"}
 
-    predictions = []
-    if combined_text: predictions.append(predict_text_bert(combined_text, run_xai=True))
-    if parsed_email["urls"]: predictions.append(predict_url_features(parsed_email["urls"], run_xai=True))
-    if parsed_email["html"]: predictions.append(predict_html_features(parsed_email["html"], run_xai=True))
+    # 🚀 While LIME/SHAP run, a watcher flips the token as soon as the client goes away
+    cancel_token = CancellationToken() if request is not None else None
+    watcher = asyncio.create_task(watch_disconnect(request, cancel_token)) if request is not None else None
+    lime_options = {"num_samples": raw_email.num_samples, "batch_size": raw_email.lime_batch_size}
+    try:
+        predictions = await run_prediction_stages(parsed_email, combined_text, run_xai=True, deadline_ms=XAI_STAGE_DEADLINE_MS,
+                                                  lime_options=lime_options, cancel_token=cancel_token)
+    except OperationCancelled:
+        logging.info("🚀 Client disconnected during XAI. Stopped LIME/SHAP early.")
+        cancellation_stats.record(requests_cancelled=1, llm_calls_skipped=1)
+        return {"status": "cancelled"}
+    finally:
+        if watcher is not None: watcher.cancel()
     
     # Grab top phishing words
     bad_words = []
@@ -537,40 +1012,61 @@ async def explain_threat_endpoint(
             bad_words = [item["word"] for item in pos_words[:3]]
 
     # 🚀 DISCONNECTION CHECK 2: Before expensive Groq Call
-    if await request.is_disconnected():
+    if request is not None and await request.is_disconnected():
         logging.info("🚀 Client disconnected before Groq call. Skipping.")
+        cancellation_stats.record(requests_cancelled=1, llm_calls_skipped=1)
         return {"status": "cancelled"}
 
-    prompt = f"""
-    You are a cybersecurity AI explaining a phishing alert to a non-technical user.
-    
-    EVIDENCE DETECTED:
-    - Link Spoofing: {is_spoofed}
-    - Suspicious Text Lures: {bad_words}
-    
-    FORMATTING & CONTENT RULES:
-    1. Output a STRICT bulleted list using '- '. Do not write an intro or outro paragraph. Maximum 3 bullets.
-    2. Analyze the EVIDENCE provided:
-       - If Link Spoofing is True, explain that a visible link is deceptively hiding its true destination. IF FALSE, DO NOT MENTION SPOOFING OR LINKS AT ALL.
-       - If Suspicious Text Lures are present, mentally filter out brand names and URL artifacts (like 'roblox', 'google', 'com', 'http'). Name the remaining words and identify the specific psychological tactic the attacker is using (e.g., creating false urgency, posing as an authority, offering a fake reward, or inducing fear).
-       - If neither Spoofing nor Text Lures are present, explain that the email's hidden code and structure matched known malicious patterns.
-    3. Actionable Advice: The final bullet point MUST start with "Advice: " and provide one sentence telling the user exactly what to do or check based on the specific threats found.
-    4. ZERO technical jargon. Do not mention SHAP, LIME, HTML, URLs, models, or weights.
-    """
-    
-    try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}], 
-            model="llama-3.3-70b-versatile", 
-            max_tokens=300,
-            temperature=0.0
-        )
-        explanation = chat_completion.choices[0].message.content
-    except Exception as e:
-        logging.error(f"❌ Error communicating with Groq API: {e}")
-        explanation = "- System unable to generate detailed explanation due to API error."
+    # Groq is network I/O on the shared async client: bounded, deadlined, never blocks the loop
+    explanation = await generate_threat_explanation(is_spoofed, bad_words)
     
-    return {
+    result = {
         "human_readable_explanation": explanation,
         "individual_predictions": predictions
-    }
\ No newline at end of file
+    }
+    # Partial results (a failed stage or the API-error fallback) are not cached
+    if cache_key and explanation != GROQ_FALLBACK_EXPLANATION and not any("error" in p for p in predictions):
+        xai_cache.put(cache_key, result)
+    return result
+
+xai_jobs = XaiJobQueue(run_explain_threat, max_workers=XAI_JOB_WORKERS, max_queued=XAI_JOB_MAX_QUEUED,
+                       retention_s=XAI_JOB_RETENTION_S)
+
+@app.post("/explain-threat")
+async def explain_threat_endpoint(
+    request: Request,                   # 🚀 Added Request
+    raw_email: ExplainThreatInput, 
+    x_api_key: str = Header(None)
+):
+    if x_api_key != EXPECTED_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized internal request")
+    
+    return await run_explain_threat(raw_email, request)
+
+# 3. Queued XAI Analysis (submit, then poll for the result)
+@app.post("/explain-threat/jobs", status_code=202)
+async def submit_explain_job_endpoint(
+    raw_email: ExplainThreatInput, 
+    x_api_key: str = Header(None)
+):
+    if x_api_key != EXPECTED_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized internal request")
+
+    # The same email with the same LIME options shares one job
+    job, deduplicated = xai_jobs.submit(explain_request_key(raw_email), raw_email)
+    return {"job_id": job.job_id, "status": job.status, "deduplicated": deduplicated}
+
+@app.get("/explain-threat/jobs/{job_id}")
+async def explain_job_status_endpoint(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to long-poll for completion"),
+    x_api_key: str = Header(None)
+):
+    if x_api_key != EXPECTED_KEY:
+        raise HTTPException(status_code=403, detail="Unauthorized internal request")
+
+    job = xai_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    await xai_jobs.wait(job, min(wait, XAI_JOB_MAX_WAIT_S))
+    return job.to_dict()
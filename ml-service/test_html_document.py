@@ -0,0 +1,33 @@
+# test_html_document.py
+# Regression cases for HTMLDocument (no server or models needed).
+#
+#   python test_html_document.py
+from html_document import HTMLDocument
+
+
+def test_anchor_href_any_case():
+    # Well-formed markup goes through the XML parser, which keeps attribute case
+    for html in ['<A HREF="http://evil.com">paypal.com</A>',
+                 '<a Href="http://evil.com">paypal.com</a>',
+                 '<p>Sign in: <a HREF="http://evil.com">paypal.com</a></p><br>']:
+        assert HTMLDocument(html).anchors == [("http://evil.com", "paypal.com")], html
+
+
+def test_tag_count_ignores_fragment_wrapper():
+    cases = {
+        '<div>a</div>': 1,
+        '<div>a</div><p>b</p>': 2,
+        '<span>a</span> tail': 1,
+        '<p>a</p><p>b</p>': 2,
+        'x <b>y</b>': 1,
+        '<div>a<br></div>': 2,
+        '<html><body><div>a</div></body></html>': 3,
+    }
+    for html, expected in cases.items():
+        assert HTMLDocument(html).tag_count == expected, (html, HTMLDocument(html).tag_count)
+
+
+if __name__ == "__main__":
+    test_anchor_href_any_case()
+    test_tag_count_ignores_fragment_wrapper()
+    print("✅ HTMLDocument regression cases pass")
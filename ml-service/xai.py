@@ -0,0 +1,188 @@
+"""
+Explainability helpers (SHAP + LIME) shared by the prediction functions in main.py.
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import shap
+from sklearn.metrics.pairwise import pairwise_distances
+from lime.lime_text import LimeTextExplainer, IndexedString, IndexedCharacters, TextDomainMapper
+
+from cancellation import CancellationToken, OperationCancelled, cancellation_stats
+
+
+class CachedTreeExplainer:
+    """
+    A shap.TreeExplainer built once at model-load time and reused by every
+    request. Building one re-walks and re-encodes the whole tree ensemble, so
+    doing it per request was pure overhead. Calls are serialized with a lock
+    because SHAP explainers are not documented as thread-safe.
+    """
+
+    def __init__(self, model, name: str):
+        self.name = name
+        self.explainer = shap.TreeExplainer(model)
+        self._lock = threading.Lock()
+
+    def top_features(self, feature_names: List[str], feature_values: List, top_k: int = 5,
+                     cancel_token: Optional[CancellationToken] = None) -> List[Dict]:
+        """SHAP values for one instance, sorted by absolute impact."""
+        with self._lock:
+            # Checked after waiting for the lock, since another request may have held it for a while
+            if cancel_token is not None and cancel_token.cancelled:
+                cancellation_stats.record(shap_explanations_skipped=1)
+                raise OperationCancelled()
+            shap_values = self.explainer.shap_values(np.array([feature_values]))
+
+        if isinstance(shap_values, list):
+            instance_shap_values = shap_values[1][0]
+        else:
+            instance_shap_values = shap_values[0]
+
+        shap_explanation_data = [
+            {"feature": feat, "shap_value": float(val)}
+            for feat, val in zip(feature_names, instance_shap_values)
+        ]
+        shap_explanation_data.sort(key=lambda x: abs(x["shap_value"]), reverse=True)
+        return shap_explanation_data[:top_k]
+
+
+def build_tree_explainer(model, name: str) -> Optional[CachedTreeExplainer]:
+    if model is None:
+        return None
+    try:
+        explainer = CachedTreeExplainer(model, name)
+        logging.info(f"✅ SHAP explainer ready for {name} model")
+        return explainer
+    except Exception as e:
+        logging.error(f"❌ Error building SHAP explainer for {name} model: {e}")
+        return None
+
+
+def require_explainer(explainer: Optional[CachedTreeExplainer], name: str) -> CachedTreeExplainer:
+    if explainer is None:
+        raise RuntimeError(f"SHAP explainer for {name} model is not available")
+    return explainer
+
+
+# ============================================================
+# FAST LIME (batched, length-bucketed, de-duplicated, adaptive)
+# ============================================================
+
+class FastLimeTextExplainer:
+    """
+    Drop-in replacement for LimeTextExplainer.explain_instance on BERT.
+
+    Stock LIME sends every perturbation to the model as ONE padded batch
+    (500 x 512 tokens on CPU). This engine instead:
+      - de-duplicates identical perturbed strings before scoring them
+      - sorts the unique strings by length so each sub-batch pads to similar sizes
+      - scores them in fixed-size sub-batches
+      - (adaptive) grows the sample in steps and stops once the top word
+        weights stop moving between steps
+    Sampling, kernel and the final weighted regression are LIME's own.
+    """
+
+    def __init__(self, lime_explainer: LimeTextExplainer):
+        # Reuse the kernel / tokenisation settings of the global explainer
+        self.lime = lime_explainer
+
+    def _index(self, text: str):
+        if self.lime.char_level:
+            return IndexedCharacters(text, bow=self.lime.bow, mask_string=self.lime.mask_string)
+        return IndexedString(text, bow=self.lime.bow, split_expression=self.lime.split_expression,
+                             mask_string=self.lime.mask_string)
+
+    def _score(self, texts: List[str], predict_fn: Callable, batch_size: int, memo: Dict, stats: Dict,
+               cancel_token: Optional[CancellationToken] = None) -> np.ndarray:
+        """Scores texts through predict_fn in sorted, de-duplicated sub-batches."""
+        pending = sorted({t for t in texts if t not in memo}, key=len)
+        for start in range(0, len(pending), batch_size):
+            if cancel_token is not None: cancel_token.check()
+            chunk = pending[start:start + batch_size]
+            for t, row in zip(chunk, predict_fn(chunk)):
+                memo[t] = row
+            stats["model_batches"] += 1
+        stats["unique_evaluated"] = len(memo)
+        return np.array([memo[t] for t in texts])
+
+    def _fit(self, data, labels, distances, num_features: int, label: int, feature_selection: str):
+        _, local_exp, _, _ = self.lime.base.explain_instance_with_data(
+            data, labels, distances, label, num_features, feature_selection=feature_selection
+        )
+        return local_exp
+
+    def explain(self, text: str, predict_fn: Callable, num_features: int = 5, num_samples: int = 500,
+                batch_size: int = 32, adaptive: bool = True, min_samples: int = 100, step: int = 100,
+                tolerance: float = 0.01, patience: int = 2, label: int = 1,
+                random_state: Optional[np.random.RandomState] = None,
+                cancel_token: Optional[CancellationToken] = None) -> Tuple[List[Tuple[str, float]], Dict]:
+        """Returns ([(word, weight), ...], stats) like exp.as_list(label=1)."""
+        started = time.perf_counter()
+        rng = random_state if random_state is not None else np.random.RandomState()
+        indexed = self._index(text)
+        doc_size = indexed.num_words()
+        stats = {"samples": 0, "unique_evaluated": 0, "model_batches": 0, "stopped_early": False}
+        if doc_size == 0:
+            return [], stats
+
+        num_samples = max(2, int(num_samples))
+        batch_size = max(1, int(batch_size))
+        step = max(1, int(step)) if adaptive else num_samples
+
+        memo = {}
+        data_rows, texts, distances, labels = [], [], [], []
+        previous_top, stable_rounds = None, 0
+
+        while len(texts) < num_samples:
+            chunk_size = min(step, num_samples - len(texts))
+            chunk_rows, chunk_texts = [], []
+            for _ in range(chunk_size):
+                row = np.ones(doc_size)
+                if texts or chunk_texts:
+                    # Same perturbation LIME uses: drop a random number of random words
+                    inactive = rng.choice(doc_size, rng.randint(1, doc_size + 1), replace=False)
+                    row[inactive] = 0
+                    chunk_texts.append(indexed.inverse_removing(inactive))
+                else:
+                    chunk_texts.append(indexed.raw_string())  # row 0 is the original text
+                chunk_rows.append(row)
+
+            chunk_data = np.array(chunk_rows)
+            try:
+                labels.append(self._score(chunk_texts, predict_fn, batch_size, memo, stats, cancel_token))
+            except OperationCancelled:
+                cancellation_stats.record(lime_samples_skipped=num_samples - len(texts))
+                raise
+            distances.append(pairwise_distances(sp.csr_matrix(chunk_data), sp.csr_matrix(np.ones((1, doc_size))),
+                                                metric='cosine').ravel() * 100)
+            data_rows.append(chunk_data)
+            texts.extend(chunk_texts)
+
+            if not adaptive or len(texts) < min_samples or len(texts) >= num_samples:
+                continue
+
+            # Cheap stability probe (one ridge fit) on the sample collected so far
+            top = self._fit(np.vstack(data_rows), np.vstack(labels), np.concatenate(distances),
+                            num_features, label, 'highest_weights')
+            if previous_top is not None and [f for f, _ in top] == [f for f, _ in previous_top] and \
+                    max(abs(w - pw) for (_, w), (_, pw) in zip(top, previous_top)) <= tolerance:
+                stable_rounds += 1
+                if stable_rounds >= patience:
+                    stats["stopped_early"] = True
+                    break
+            else:
+                stable_rounds = 0
+            previous_top = top
+
+        local_exp = self._fit(np.vstack(data_rows), np.vstack(labels), np.concatenate(distances),
+                              num_features, label, self.lime.feature_selection)
+        stats["samples"] = len(texts)
+        stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        words = TextDomainMapper(indexed).map_exp_ids(local_exp)
+        return [(str(word), float(weight)) for word, weight in words], stats